@@ -0,0 +1,123 @@
+import datetime
+import time
+from types import SimpleNamespace
+from typing import Any
+
+import discord
+from discord.ext import commands
+
+
+class FakeUser:
+    def __init__(self, user_id: int, name: str, roles: list[str]) -> None:
+        self.id = user_id
+        self.name = name
+        self.mention = f"<@{user_id}>"
+        self.roles = [SimpleNamespace(id=i, name=role) for i, role in enumerate(roles)]
+
+    def __eq__(self, other: object) -> bool:
+        return isinstance(other, FakeUser) and other.id == self.id
+
+    def __hash__(self) -> int:
+        return hash(self.id)
+
+    def mentioned_in(self, message: discord.Message) -> bool:
+        return self in message.mentions
+
+
+class FakeAttachment:
+    def __init__(self, attachment_id: int, data: bytes, content_type: str) -> None:
+        self.id = attachment_id
+        self.size = len(data)
+        self.url = f"https://cdn.example.invalid/attachments/{attachment_id}"
+        self.content_type = content_type
+        self.data = data
+
+    async def read(self) -> bytes:
+        return self.data
+
+
+class FakeMessage(discord.Message):
+    # Real discord.Message subclass, so the paginator's type checks pass; only the fields the
+    # bot reads are filled in. The ID is a snowflake, which gives created_at for free.
+    def __init__(self, channel: "FakeChannel", author: FakeUser, content: str, created_at: datetime.datetime | None = None, attachments: list[FakeAttachment] | None = None, mentions: list[FakeUser] | None = None, reference: discord.Message | None = None) -> None:
+        self._state = None
+        self.id = channel.next_id(created_at)
+        self.channel = channel
+        self.guild = None
+        self.author = author
+        self.content = content
+        self.attachments = attachments or []
+        self.mentions = mentions or []
+        self.mention_everyone = False
+        self.reference = discord.MessageReference(message_id=reference.id, channel_id=channel.id) if reference is not None else None
+        self._edited_timestamp = None
+
+    def copy_with(self, content: str) -> "FakeMessage":
+        edited = object.__new__(FakeMessage)
+        for name in ("id", "channel", "guild", "author", "attachments", "mentions", "mention_everyone", "reference", "_edited_timestamp", "_state"):
+            setattr(edited, name, getattr(self, name))
+        edited.content = content
+        return edited
+
+    async def edit(self, **kwargs: Any) -> "FakeMessage":
+        self.channel.log("edit", kwargs)
+        if "content" in kwargs:
+            self.content = kwargs["content"]
+        return self
+
+
+class FakeChannel(discord.abc.Messageable):
+    def __init__(self, channel_id: int, bot_user: FakeUser) -> None:
+        self.id = channel_id
+        self.bot_user = bot_user
+        self.messages: dict[int, FakeMessage] = {}
+        # (perf_counter time, action, ID of the message replied to or None).
+        self.sent: list[tuple[float, str, int | None]] = []
+        self.last_id = 0
+
+    def next_id(self, created_at: datetime.datetime | None) -> int:
+        # Snowflakes must be unique and increasing even within the same millisecond.
+        self.last_id = max(discord.utils.time_snowflake(created_at or discord.utils.utcnow()), self.last_id + 1)
+        return self.last_id
+
+    def add(self, message: FakeMessage) -> FakeMessage:
+        self.messages[message.id] = message
+        return message
+
+    def log(self, action: str, kwargs: dict[str, Any]) -> None:
+        reference = kwargs.get("reference")
+        self.sent.append((time.perf_counter(), action, getattr(reference, "message_id", getattr(reference, "id", None))))
+
+    async def _get_channel(self) -> "FakeChannel":
+        return self
+
+    async def send(self, content: str | None = None, **kwargs: Any) -> FakeMessage:
+        self.log("send", kwargs)
+        return self.add(FakeMessage(self, self.bot_user, content or ""))
+
+    async def fetch_message(self, message_id: int) -> FakeMessage:
+        if message_id not in self.messages:
+            raise discord.NotFound(SimpleNamespace(status=404, reason="Not Found"), "Unknown Message")
+        return self.messages[message_id]
+
+
+class FakeContext(commands.Context):
+    author = None
+    channel = None
+
+    def __init__(self, message: FakeMessage) -> None:
+        self.message = message
+        self.author = message.author
+        self.channel = message.channel
+
+
+class FakeBot:
+    def __init__(self, user: FakeUser, channels: list[FakeChannel]) -> None:
+        self.user = user
+        self.channels = {channel.id: channel for channel in channels}
+
+    def get_channel(self, channel_id: int) -> FakeChannel | None:
+        return self.channels.get(channel_id)
+
+    async def get_context(self, message: FakeMessage) -> FakeContext:
+        return FakeContext(message)
@@ -0,0 +1,106 @@
+import asyncio
+import json
+import random
+import time
+from collections import defaultdict
+from types import SimpleNamespace
+from typing import Any, Iterator
+
+from google.genai import types
+
+from the_math_guys_bot.ai.history import ATTACHMENT_TOKEN_ESTIMATE, get_part_text
+
+
+FORMULAS: list[str] = [
+    "\\int_0^1 x^2 \\, dx = \\frac{1}{3}",
+    "\\sum_{n=1}^{\\infty} \\frac{1}{n^2} = \\frac{\\pi^2}{6}",
+    "e^{i\\pi} + 1 = 0",
+    "\\frac{d}{dx} \\sen x = \\cos x",
+    "a^2 + b^2 = c^2",
+    "\\lim_{x \\to 0} \\frac{\\sen x}{x} = 1",
+]
+
+
+def count_tokens(contents: list[dict[str, Any]]) -> int:
+    # Same four-characters-per-token estimate as the history, plus the fixed cost of media.
+    tokens = 0
+    for turn in contents:
+        for part in turn["parts"]:
+            text = get_part_text(part)
+            tokens += len(text) // 4 + 1 if text is not None else ATTACHMENT_TOKEN_ESTIMATE
+    return tokens
+
+
+class FakeModels:
+    # Stand-in for client.aio.models: answers with plausible JSON after a configurable delay and
+    # records the size of every prompt.
+    def __init__(self, latency: float, token_latency: float, chunk_tokens: int, seed: int) -> None:
+        self.latency = latency
+        self.token_latency = token_latency
+        self.chunk_tokens = chunk_tokens
+        self.random = random.Random(seed)
+        # Kind of call -> prompt tokens of each call, in order.
+        self.prompt_tokens: defaultdict[str, list[int]] = defaultdict(list)
+        self.output_tokens: defaultdict[str, int] = defaultdict(int)
+
+    def get_kind(self, config: types.GenerateContentConfig) -> str:
+        if config.response_schema is None:
+            return "summary"
+        if "introduction" in (config.response_schema.properties or {}):
+            return "answer"
+        return "classifier"
+
+    def get_text(self, kind: str) -> str:
+        if kind == "summary":
+            return "Resumen: los usuarios conversaron sobre cálculo y álgebra. " * self.random.randint(1, 4)
+        if kind == "classifier":
+            return json.dumps({"search_queries": [], "youtube_video_links": []})
+        steps = []
+        for _ in range(self.random.randint(0, 4)):
+            if self.random.random() < 0.6:
+                steps.append({"step_formula_text_or_code": self.random.choice(FORMULAS), "step_description": "Aplicamos la propiedad. " * 3, "step_formula_text_or_code_type": "formula"})
+            else:
+                steps.append({"step_formula_text_or_code": "print('hola')", "step_description": "Un ejemplo en Python.", "step_formula_text_or_code_type": "code"})
+        return json.dumps({
+            "introduction": "¡Claro! Vamos paso a paso <:nerdface:1196602262215204914>. " * self.random.randint(1, 5),
+            "steps": steps,
+            "tasks_to_add": [],
+            "tasks_to_edit": [],
+            "tasks_to_remove": [],
+        }, ensure_ascii=False)
+
+    def record(self, config: types.GenerateContentConfig, contents: list[dict[str, Any]]) -> tuple[str, str]:
+        kind = self.get_kind(config)
+        self.prompt_tokens[kind].append(count_tokens(contents) + len(config.system_instruction or "") // 4)
+        text = self.get_text(kind)
+        self.output_tokens[kind] += len(text) // 4 + 1
+        return kind, text
+
+    async def generate_content(self, model: str, contents: list[dict[str, Any]], config: types.GenerateContentConfig) -> SimpleNamespace:
+        kind, text = self.record(config, contents)
+        await asyncio.sleep(self.latency + self.token_latency * (len(text) // 4))
+        return make_response(text, kind != "summary")
+
+    def generate_content_stream(self, model: str, contents: list[dict[str, Any]], config: types.GenerateContentConfig) -> Iterator[SimpleNamespace]:
+        # What client.models.generate_content_stream returns: a blocking iterator.
+        kind, text = self.record(config, contents)
+        time.sleep(self.latency)
+        chunk_size = self.chunk_tokens * 4
+        for start in range(0, len(text), chunk_size):
+            time.sleep(self.token_latency * self.chunk_tokens)
+            yield SimpleNamespace(text=text[start:start + chunk_size])
+
+    async def count_tokens(self, model: str, contents: list[dict[str, Any]]) -> SimpleNamespace:
+        return SimpleNamespace(total_tokens=count_tokens(contents))
+
+
+def make_response(text: str, is_json: bool) -> SimpleNamespace:
+    content = SimpleNamespace(model_dump=lambda: {"parts": [{"text": text}], "role": "model"})
+    return SimpleNamespace(text=text, parsed=json.loads(text) if is_json else None, candidates=[SimpleNamespace(content=content)])
+
+
+class FakeGenAIClient:
+    def __init__(self, models: FakeModels) -> None:
+        # Streams are read through the sync API, everything else through the async one.
+        self.models = models
+        self.aio = SimpleNamespace(models=models)
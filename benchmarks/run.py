@@ -0,0 +1,247 @@
+# Offline benchmark of the bot's hot paths. Synthetic server traffic (chatter, mentions,
+# attachments, edits and deletes) is replayed through the AI cog's listeners against a fake
+# Discord and a fake Gemini, so it needs no network or tokens:
+#
+#     python -m benchmarks.run --events 500 --rate 20 --json results.json
+#
+# Everything the bot writes to disk goes to a temporary directory.
+import argparse
+import asyncio
+import json
+import os
+import random
+import resource
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+from collections import defaultdict
+from pathlib import Path
+from typing import Any
+
+
+BOT_ID: int = 1194231765175369788
+CHATTER: list[str] = [
+    "alguien sabe cómo se deriva un producto?",
+    "hoy estudié integrales por partes",
+    "la tarea de álgebra lineal está difícil",
+    "me salió el ejercicio 3, gracias",
+    "does anyone know a good topology book?",
+    "jajaja",
+    "qué es un espacio vectorial?",
+]
+QUESTIONS: list[str] = [
+    "cómo resuelvo la integral de x^2 entre 0 y 1?",
+    "explícame la identidad de Euler",
+    "cuánto suma la serie de 1/n^2?",
+    "busca la documentación de numpy para matrices",
+    "what is the derivative of sin x?",
+]
+
+
+def percentile(values: list[float], p: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(int(p / 100 * len(values)), len(values) - 1)]
+
+
+def get_memory_bytes(use_tracemalloc: bool) -> int:
+    if use_tracemalloc:
+        return tracemalloc.get_traced_memory()[0]
+    statm = Path("/proc/self/statm")
+    if statm.exists():
+        return int(statm.read_text().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    # Peak rather than current, where /proc is not available.
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * (1 if sys.platform == "darwin" else 1024)
+
+
+def generate_traffic(count: int, channels: int, users: int, seed: int) -> list[tuple[str, int, int, str, int | None]]:
+    # (kind, channel index, user index, text, index of the earlier event it targets).
+    rng = random.Random(seed)
+    events = []
+    sent: list[int] = []
+    for i in range(count):
+        roll = rng.random()
+        channel = rng.randrange(channels)
+        user = rng.randrange(users)
+        if roll < 0.08 and sent:
+            target = rng.choice(sent)
+            events.append(("edit", events[target][1], events[target][2], rng.choice(CHATTER), target))
+        elif roll < 0.11 and sent:
+            target = sent.pop(rng.randrange(len(sent)))
+            events.append(("delete", events[target][1], events[target][2], "", target))
+        elif roll < 0.26:
+            events.append(("mention", channel, user, f"<@{BOT_ID}> {rng.choice(QUESTIONS)}", None))
+            sent.append(i)
+        elif roll < 0.31:
+            events.append(("attachment", channel, user, rng.choice(CHATTER), None))
+            sent.append(i)
+        else:
+            events.append(("chatter", channel, user, rng.choice(CHATTER), None))
+            sent.append(i)
+    return events
+
+
+async def replay(args: argparse.Namespace) -> dict[str, Any]:
+    # The bot's modules create their caches and databases on import, inside the working directory.
+    from benchmarks.fake_discord import FakeAttachment, FakeBot, FakeChannel, FakeMessage, FakeUser
+    from benchmarks.fake_gemini import FakeGenAIClient, FakeModels
+    from the_math_guys_bot.ai import engine
+    from the_math_guys_bot.cogs import ai
+    from the_math_guys_bot.cogs.metrics import STAGES
+    from the_math_guys_bot.utils.metrics import metrics
+
+    models = FakeModels(args.latency, args.token_latency, args.chunk_tokens, args.seed)
+    engine.client = FakeGenAIClient(models)
+    ai.STREAM_RESPONSES = not args.no_stream
+
+    bot_user = FakeUser(BOT_ID, "TheMathGuysBot", [])
+    users = [FakeUser(10 ** 17 + i, f"user{i}", [random.Random(i).choice(["Español", "English"])]) for i in range(args.users)]
+    channels = [FakeChannel(10 ** 18 + i, bot_user) for i in range(args.channels)]
+    cog = ai.AI(FakeBot(bot_user, channels))
+    rng = random.Random(args.seed)
+
+    traffic = generate_traffic(args.events, args.channels, args.users, args.seed)
+    messages: dict[int, FakeMessage] = {}
+    latencies: defaultdict[str, list[float]] = defaultdict(list)
+    first_reply_latencies: list[float] = []
+    memory_samples: list[tuple[int, int]] = [(0, get_memory_bytes(args.tracemalloc))]
+
+    async def dispatch(index: int, kind: str, channel: FakeChannel, user: FakeUser, text: str, target: int | None) -> None:
+        start = time.perf_counter()
+        if kind == "edit":
+            before = messages[target]
+            after = before.copy_with(text)
+            messages[target] = channel.add(after)
+            await cog.on_message_edit(before, after)
+        elif kind == "delete":
+            message = channel.messages.pop(messages[target].id)
+            await cog.on_message_delete(message)
+        else:
+            attachments = [FakeAttachment(index, rng.randbytes(args.attachment_bytes), "image/png")] if kind == "attachment" else []
+            mentions = [bot_user] if kind == "mention" else []
+            # Some messages reply to an earlier one in the same channel.
+            reference = rng.choice(list(channel.messages.values())) if channel.messages and rng.random() < 0.2 else None
+            message = messages[index] = channel.add(FakeMessage(channel, user, text, attachments=attachments, mentions=mentions, reference=reference))
+            await cog.on_message(message)
+            if kind == "mention":
+                replies = [sent_at for sent_at, _, reference_id in channel.sent if reference_id == message.id]
+                if replies:
+                    first_reply_latencies.append(min(replies) - start)
+        latencies[kind].append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    dispatched = []
+    for index, (kind, channel_index, user_index, text, target) in enumerate(traffic):
+        if args.rate > 0:
+            await asyncio.sleep(max(start + index / args.rate - time.perf_counter(), 0))
+        # Like the gateway, every event is handled in its own task.
+        dispatched.append(asyncio.create_task(dispatch(index, kind, channels[channel_index], users[user_index], text, target)))
+        if args.rate <= 0:
+            await dispatched[-1]
+        if (index + 1) % max(args.events // 10, 1) == 0:
+            memory_samples.append((index + 1, get_memory_bytes(args.tracemalloc)))
+    await asyncio.gather(*dispatched)
+    elapsed = time.perf_counter() - start
+    # Paginator renders and history compaction keep running in the background.
+    background = [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+    await asyncio.wait(background, timeout=args.drain_timeout) if background else None
+    memory_samples.append((args.events, get_memory_bytes(args.tracemalloc)))
+
+    answer_prompts = models.prompt_tokens["answer"]
+    return {
+        "events": args.events,
+        "elapsed_seconds": elapsed,
+        "latency_ms": {
+            kind: {"count": len(values), "p50": percentile(values, 50) * 1000, "p95": percentile(values, 95) * 1000, "p99": percentile(values, 99) * 1000, "max": max(values) * 1000}
+            for kind, values in sorted(latencies.items())
+        },
+        # The bot's own per-stage timings over the run.
+        "stages_ms": {stage: dict(zip(("count", "p50", "p95"), (count, p50 * 1000, p95 * 1000))) for stage in STAGES for count, p50, p95 in [metrics.get_summary(stage)] if count},
+        "first_reply_ms": {"p50": percentile(first_reply_latencies, 50) * 1000, "p95": percentile(first_reply_latencies, 95) * 1000},
+        "prompt_tokens": {
+            "calls": {kind: len(values) for kind, values in models.prompt_tokens.items()},
+            "output_tokens": dict(models.output_tokens),
+            # Prompt size of the answer calls at each tenth of the run, to show history growth.
+            "answer_growth": [answer_prompts[min(i * len(answer_prompts) // 10, len(answer_prompts) - 1)] for i in range(11)] if answer_prompts else [],
+            "answer_max": max(answer_prompts, default=0),
+        },
+        "memory_bytes": memory_samples,
+        "memory_growth_bytes": memory_samples[-1][1] - memory_samples[0][1],
+    }
+
+
+async def measure_rendering(args: argparse.Namespace) -> dict[str, Any]:
+    from the_math_guys_bot.utils.latex import latex2images
+
+    if shutil.which("latex") is None or shutil.which("dvisvgm") is None or shutil.which("inkscape") is None:
+        return {"skipped": "latex, dvisvgm or inkscape is not installed"}
+    expressions = [f"\\int_0^{{{i}}} x^{{{i % 7 + 1}}} \\, dx" for i in range(args.formulas)]
+    results = {}
+    for run in ("cold", "warm"):
+        start = time.perf_counter()
+        images = await asyncio.gather(*(latex2images(expressions[i:i + 4]) for i in range(0, len(expressions), 4)))
+        elapsed = time.perf_counter() - start
+        rendered = sum(image is not None for batch in images for image in batch)
+        results[run] = {"formulas": len(expressions), "rendered": rendered, "seconds": elapsed, "formulas_per_second": len(expressions) / elapsed}
+    return results
+
+
+def print_report(results: dict[str, Any]) -> None:
+    print(f"{results['events']} events in {results['elapsed_seconds']:.2f} s")
+    print(f"{'event':<12}{'count':>7}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+    for kind, stats in results["latency_ms"].items():
+        print(f"{kind:<12}{stats['count']:>7}{stats['p50']:>10.1f}{stats['p95']:>10.1f}{stats['p99']:>10.1f}{stats['max']:>10.1f}")
+    for stage, stats in results["stages_ms"].items():
+        print(f"  stage {stage:<12}{stats['count']:>5}{stats['p50']:>10.1f}{stats['p95']:>10.1f}")
+    print(f"first reply to a mention: p50 {results['first_reply_ms']['p50']:.1f} ms, p95 {results['first_reply_ms']['p95']:.1f} ms")
+    prompt_tokens = results["prompt_tokens"]
+    print(f"model calls: {prompt_tokens['calls']}, output tokens: {prompt_tokens['output_tokens']}")
+    print(f"answer prompt tokens by tenth of the run: {prompt_tokens['answer_growth']} (max {prompt_tokens['answer_max']})")
+    print(f"memory growth: {results['memory_growth_bytes'] / 1024 / 1024:.1f} MiB")
+    print(f"rendering: {results['rendering']}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Replay synthetic server traffic through the bot against fake Discord and Gemini.")
+    parser.add_argument("--events", type=int, default=300)
+    parser.add_argument("--channels", type=int, default=4)
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--rate", type=float, default=20, help="Events per second; 0 replays them one after another.")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--latency", type=float, default=0.3, help="Seconds before the fake model starts answering.")
+    parser.add_argument("--token-latency", type=float, default=0.002, help="Seconds per output token.")
+    parser.add_argument("--chunk-tokens", type=int, default=20, help="Tokens per streamed chunk.")
+    parser.add_argument("--attachment-bytes", type=int, default=200_000)
+    parser.add_argument("--formulas", type=int, default=16, help="Formulas for the rendering benchmark.")
+    parser.add_argument("--drain-timeout", type=float, default=60)
+    parser.add_argument("--no-stream", action="store_true", help="Benchmark the non-streaming answer path.")
+    parser.add_argument("--tracemalloc", action="store_true", help="Measure Python allocations instead of RSS (slower).")
+    parser.add_argument("--json", type=Path, help="Also write the results to this file.")
+    args = parser.parse_args()
+
+    json_path = args.json.resolve() if args.json is not None else None
+    os.environ.setdefault("GOOGLE_API_KEY", "benchmark")
+    sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+    working_directory = os.getcwd()
+    with tempfile.TemporaryDirectory(prefix="bot-benchmark-") as directory:
+        os.chdir(directory)
+        if args.tracemalloc:
+            tracemalloc.start()
+
+        async def run() -> dict[str, Any]:
+            results = await replay(args)
+            results["rendering"] = await measure_rendering(args)
+            return results
+
+        results = asyncio.run(run())
+        os.chdir(working_directory)
+    print_report(results)
+    if json_path is not None:
+        json_path.write_text(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
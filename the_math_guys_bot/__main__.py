@@ -12,6 +12,7 @@ def main() -> None:
     bot.load_extension("the_math_guys_bot.cogs.ai")
     bot.load_extension("the_math_guys_bot.cogs.helpers")
     bot.load_extension("the_math_guys_bot.cogs.inactive_kick")
+    bot.load_extension("the_math_guys_bot.cogs.metrics")
     bot.run(os.getenv("DISCORD_TOKEN"))
 
 
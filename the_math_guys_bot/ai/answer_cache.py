@@ -0,0 +1,50 @@
+import asyncio
+import hashlib
+import json
+import os
+import re
+import unicodedata
+from pathlib import Path
+from typing import Any
+
+from the_math_guys_bot.utils.attachment_store import AttachmentRef
+from the_math_guys_bot.utils.disk_cache import DiskCache
+
+
+# ANSWER_CACHE=0 turns the cache off.
+ANSWER_CACHE_ENABLED: bool = os.getenv("ANSWER_CACHE", "1") == "1"
+ANSWER_CACHE_DIR: Path = Path(os.getenv("ANSWER_CACHE_DIR", "answer_cache"))
+ANSWER_CACHE_MAX_BYTES: int = int(os.getenv("ANSWER_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+ANSWER_CACHE_TTL: float = float(os.getenv("ANSWER_CACHE_TTL_HOURS", "24")) * 3600
+
+
+answer_cache = DiskCache(ANSWER_CACHE_DIR, ANSWER_CACHE_MAX_BYTES, ANSWER_CACHE_TTL)
+
+
+def normalize_question(text: str) -> str:
+    # Mentions are dropped, so "@bot question" and "question @bot" are the same question.
+    text = re.sub(r"<@!?\d+>", " ", unicodedata.normalize("NFKC", text))
+    return " ".join(text.casefold().split())
+
+
+def get_answer_key(text: str, files: list[AttachmentRef], languages: str) -> str:
+    # Attachments are keyed by content, so the same screenshot uploaded again still matches.
+    attachments = ",".join(file.sha256 for file in files)
+    return hashlib.sha256(f"answer\0{languages}\0{normalize_question(text)}\0{attachments}".encode()).hexdigest()
+
+
+def is_cacheable(response: dict[str, Any]) -> bool:
+    # Task changes must run again for whoever asks, and answers that mention someone were
+    # written for that person.
+    if response["tasks_to_add"] or response["tasks_to_edit"] or response["tasks_to_remove"]:
+        return False
+    return re.search(r"<@!?\d+>", json.dumps(response)) is None
+
+
+async def get_answer(key: str) -> dict[str, Any] | None:
+    data = await asyncio.to_thread(answer_cache.get_bytes, key)
+    return json.loads(data) if data is not None else None
+
+
+async def put_answer(key: str, response: dict[str, Any]) -> None:
+    await asyncio.to_thread(answer_cache.put_bytes, key, json.dumps(response, ensure_ascii=False).encode())
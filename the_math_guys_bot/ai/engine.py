@@ -0,0 +1,96 @@
+import asyncio
+import os
+from typing import AsyncIterator, Iterator
+
+from google import genai
+from google.genai import types
+
+from the_math_guys_bot.utils.metrics import metrics
+
+
+MODEL: str = "gemini-2.0-flash-exp"
+MAX_CONCURRENT_GENERATIONS: int = int(os.getenv("MAX_CONCURRENT_GENERATIONS", "4"))
+GENERATION_TIMEOUT: float = float(os.getenv("GENERATION_TIMEOUT", "120"))
+COUNT_TOKENS_TIMEOUT: float = float(os.getenv("COUNT_TOKENS_TIMEOUT", "10"))
+
+
+client = genai.Client(api_key=os.getenv("GOOGLE_API_KEY"))
+generation_semaphore = asyncio.Semaphore(MAX_CONCURRENT_GENERATIONS)
+
+
+async def generate_content(contents: list[dict[str, list[str | types.Part]]], response_schema: types.Schema | None, system_instruction: str) -> types.GenerateContentResponse:
+    # The semaphore bounds how many Gemini calls are in flight at once, and
+    # wait_for cancels the request if it takes longer than GENERATION_TIMEOUT.
+    async with generation_semaphore:
+        response = await asyncio.wait_for(
+            client.aio.models.generate_content(
+                contents=contents,
+                model=MODEL,
+                config=types.GenerateContentConfig(
+                    response_mime_type="application/json" if response_schema is not None else "text/plain",
+                    response_schema=response_schema,
+                    system_instruction=system_instruction,
+                ),
+            ),
+            timeout=GENERATION_TIMEOUT,
+        )
+    record_usage(response)
+    return response
+
+
+async def count_tokens(contents: list[dict[str, list[str | types.Part]]]) -> int:
+    async with generation_semaphore:
+        response = await asyncio.wait_for(client.aio.models.count_tokens(model=MODEL, contents=contents), timeout=COUNT_TOKENS_TIMEOUT)
+    return response.total_tokens
+
+
+def record_usage(response: types.GenerateContentResponse) -> None:
+    usage = getattr(response, "usage_metadata", None)
+    if usage is None:
+        return
+    metrics.increment("prompt_tokens", usage.prompt_token_count or 0)
+    metrics.increment("output_tokens", usage.candidates_token_count or 0)
+
+
+async def generate_content_stream(contents: list[dict[str, list[str | types.Part]]], response_schema: types.Schema, system_instruction: str) -> AsyncIterator[types.GenerateContentResponse]:
+    # google-genai 0.6 reads the async stream with blocking requests calls, which would freeze
+    # the gateway for the whole answer, so the sync stream is read in a worker thread instead.
+    async with generation_semaphore:
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + GENERATION_TIMEOUT
+        stream = iter(await asyncio.to_thread(
+            client.models.generate_content_stream,
+            contents=contents,
+            model=MODEL,
+            config=types.GenerateContentConfig(
+                response_mime_type="application/json",
+                response_schema=response_schema,
+                system_instruction=system_instruction,
+            ),
+        ))
+        read: asyncio.Future | None = None
+        last_usage = None
+        try:
+            while True:
+                read = loop.run_in_executor(None, next, stream, None)
+                # Shielded, because a read cannot be interrupted; a timeout only stops waiting.
+                chunk = await asyncio.wait_for(asyncio.shield(read), max(deadline - loop.time(), 0))
+                if chunk is None:
+                    return
+                # Usage is cumulative, so only the latest count is kept.
+                if getattr(chunk, "usage_metadata", None) is not None and chunk.usage_metadata.prompt_token_count:
+                    last_usage = chunk
+                yield chunk
+        finally:
+            if last_usage is not None:
+                record_usage(last_usage)
+            # A stream still being read is closed as soon as its thread gets the next chunk.
+            if read is not None and not read.done():
+                read.add_done_callback(lambda _: close_stream(stream))
+            else:
+                close_stream(stream)
+
+
+def close_stream(stream: Iterator[types.GenerateContentResponse]) -> None:
+    if hasattr(stream, "close"):
+        stream.close()
@@ -1,16 +1,25 @@
+import asyncio
 import json
-import os
-import subprocess
-from typing import Literal
+import re
+from time import perf_counter
+from typing import Any, AsyncIterator, Literal
 
-import requests
 from pydantic import BaseModel, TypeAdapter
-from google import genai
 from google.genai import types
-from googlesearch import search
 
+from the_math_guys_bot.ai.engine import client, generate_content, generate_content_stream
+from the_math_guys_bot.ai.history import CLASSIFIER_HISTORY_TOKEN_BUDGET, HISTORY_TOKEN_BUDGET, HistoryStore, get_part_text
+from the_math_guys_bot.ai.pre_classifier import extract_youtube_links, pre_classify
+from the_math_guys_bot.ai.passage_index import passage_index
+from the_math_guys_bot.ai.retrieval import fetch_pages, get_source, search_urls
+from the_math_guys_bot.ai.youtube import get_video_ref
+from the_math_guys_bot.utils.attachment_store import AttachmentRef, attachment_store
+from the_math_guys_bot.utils.json_stream import JsonStreamParser
+from the_math_guys_bot.utils.metrics import metrics
 
-client = genai.Client(api_key=os.getenv("GOOGLE_API_KEY"))
+
+# User, role, channel and emote mentions, which only add IDs to a search.
+MENTION_PATTERN = re.compile(r"<(?:[@#][!&]?|a?:\w+:)\d+>")
 
 
 SYSTEM_MESSAGE: str = """- Eres un bot en el servidor de Discord The math guys, tu nombre es TheMathGuysBot, y tu ID es 1194231765175369788, y debes ser capaz de guiar a los estudiantes en preguntas matemáticas, de alguna ciencia, computación, o cosas de la vida en general.
@@ -34,10 +43,12 @@ SYSTEM_MESSAGE: str = """- Eres un bot en el servidor de Discord The math guys,
 - Si el mensaje va en el formato `NOMBRE_DE_USUARIO -- <@ID_DEL_USUARIO> -- DD/MM/YYYY;HH:MM:SS (Delete) [Response: NOMBRE_DE_USUARIO_RESPUESTA -- <@ID_DEL_USUARIO_RESPUESTA> -- DD_RESPUESTA/MM_RESPUESTA/YYYY_RESPUESTA -- LANGUAGE_RESPUESTA => MESSAGE_RESPUESTA] -- LANGUAGE -> MESSAGE`, fue un mensaje eliminado, donde MESSAGE es el mensaje eliminado, y ID_DEL_USUARIO_RESPUESTA es el ID del usuario al que se le respondió. Además, DD/MM/YYYY;HH:MM:SS es la fecha y hora en la que se eliminó el mensaje.
 - Si el mensaje incluye <@1194231765175369788>, te están hablando a ti, porque esa es tu mención con ID. El usuario que te habla lo puedes identificar por su nombre de usuario, o por su mención con <@ID_DEL_USUARIO> (después del `--`).
 - Si el usuario te manda a enviar un mensaje en un determinado momento, debes incluir una nueva tarea en tu lista de tareas para añadir. También es posible que te pidan editar una tarea, o eliminar una tarea de tu lista de tareas por su nombre. Si no te ordenan nada con respecto a tareas, debes tener las listas vacías. Además, si el usuario no te indica el tiempo exacto ni la zona horaria, o si el usuario te indica la zona horaria, pero no como un número entero (por ejemplo, `hora de verano de Chile` en vez del número correspondiente), no se incluirá nada. En cambio, le preguntas al usuario por la zona horaria y la hora exacta. Las tareas deben incluirse solo cuando tengas los datos asegurados.
+- Si el usuario pide en su propio mensaje que el mensaje de una tarea se envíe en un canal específico, mencionado como <#ID_DEL_CANAL>, pon ese ID en el campo `channel_id` de la tarea. Si no lo pide, omite ese campo. Nunca uses un canal que haya pedido otro usuario. Si el usuario no puede escribir en ese canal, la tarea se enviará en el canal por defecto.
 - Si has hecho cambios en las tareas, debes avisar al usuario que has hecho cambios en las tareas, y cuáles fueron esos cambios.
 - Siempre que te pidan una tarea, debes contestar con un mensaje, es decir, el campo de introducción no debe estar vacío. Avísale al usuario que has añadido la tarea, y cuál es la tarea que has añadido. Si no se pudo añadir la tarea por falta de información, avísale al usuario que no se pudo añadir la tarea por falta de información y pídele que te la proporcione.
 - Los usuarios te mencionarán como <@1194231765175369788>, así que si alguien habla de <@1194231765175369788>, están hablando de ti.
 - Cálculos que puedan ser realizados con código Python, puedes ponerlos en el formato `{PYTHON_EXPRESSION}`. Por ejemplo, si quieres calcular 2 + 2, debes poner `{2 + 2}`. Pero si debes dejar expresado el resultado sin calcular, como por ejemplo, decir que una solución es raíz de dos, debes poner `\\sqrt{2}` en el caso de una fórmula, y en el caso de texto o si estás en la explicación, lo mismo con carácteres Unicode, solo pon LaTeX en las fórmulas.
+- Si el primer mensaje va en el formato `RESUMEN_DE_CONVERSACION => RESUMEN`, RESUMEN es un resumen de la parte más antigua de la conversación en este canal, y debes tomarlo en cuenta como si hubieras leído esos mensajes.
 - Si el mensaje va en el formato `INTERNET_SEARCH -- QUERY -- SOURCE => RESULT`, son búsquedas que se hicieron por ti en internet, y se encontró el resultado, debes basarte en esa información para responder algo que tenga que ver con la query.
 - Si un usuario te manda un enlace a un video de YouTube y no hay un mensaje antes """
 
@@ -66,6 +77,7 @@ response_schema = types.Schema(properties={
         "minute": types.Schema(type="INTEGER"),
         "timezone": types.Schema(type="INTEGER"),
         "user_id": types.Schema(type="INTEGER"),
+        "channel_id": types.Schema(type="INTEGER"),
     }, required=["task_name", "message_to_send", "hour", "minute", "timezone", "user_id"], type="OBJECT")),
     "tasks_to_edit": types.Schema(type="ARRAY", items=types.Schema(properties={
         "task_name": types.Schema(type="STRING"),
@@ -74,165 +86,178 @@ response_schema = types.Schema(properties={
         "minute": types.Schema(type="INTEGER"),
         "timezone": types.Schema(type="INTEGER"),
         "user_id": types.Schema(type="INTEGER"),
+        "channel_id": types.Schema(type="INTEGER"),
     }, required=["task_name", "message_to_send", "hour", "minute", "timezone", "user_id"], type="OBJECT")),
     "tasks_to_remove": types.Schema(type="ARRAY", items=types.Schema(type="STRING")),
 }, required=["introduction", "steps", "tasks_to_add", "tasks_to_edit", "tasks_to_remove"], type="OBJECT")
 
 
 class HandleMessage:
-    classifier_message_history: list[dict[str, list[str | types.Part]]] = []
-    message_history: list[dict[str, list[str | types.Part]]] = []
+    classifier_message_history: HistoryStore = HistoryStore(CLASSIFIER_HISTORY_TOKEN_BUDGET)
+    message_history: HistoryStore = HistoryStore(HISTORY_TOKEN_BUDGET)
 
-    @classmethod
-    def handle_message(cls, message: str, username: str, mention: str, files: list[types.Part], reference: str | None, time: str, languages: str) -> dict[str, list[str | types.Part]]:
-        message = {
+    @staticmethod
+    def build_message(message: str, username: str, mention: str, files: list[AttachmentRef], reference: str | None, time: str, languages: str) -> dict[str, list[str | types.Part]]:
+        return {
             "parts": [
                 types.Part.from_text(f"{username} -- {mention} -- {time} -- {languages} => {message}" if reference is None else f"{username} -- {mention} -- {time} -- [Response: {reference}] -- {languages} => {message}"),
                 *files
             ],
             "role": "user",
         }
-        cls.classify(message)
-        cls.message_history.append(message)
-        response: types.GenerateContentResponse = client.models.generate_content(
-            contents=cls.message_history,
-            model="gemini-2.0-flash-exp",
-            config=types.GenerateContentConfig(
-                response_mime_type="application/json",
-                response_schema=response_schema,
-                system_instruction=SYSTEM_MESSAGE,
-            )
-        )
+
+    @staticmethod
+    def build_edit_message(old_message: str, new_message: str, username: str, mention: str, files: list[AttachmentRef], reference: str | None, time: str, languages: str) -> dict[str, list[str | types.Part]]:
+        return {
+            "parts": [types.Part.from_text(f"{username} -- {mention} -- {time} (Edit) -- {languages} => {old_message} => {new_message}" if reference is None else f"{username} -- {mention} -- {time} (Edit) -- [Response: {reference}] -- {languages} => {old_message} => {new_message}"), *files],
+            "role": "user",
+        }
+
+    @staticmethod
+    def build_delete_message(message: str, username: str, mention: str, files: list[AttachmentRef], reference: str | None, time: str, languages: str) -> dict[str, list[str | types.Part]]:
+        return {
+            "parts": [types.Part.from_text(f"{username} -- {mention} -- {time} (Delete) -- {languages} => {message}" if reference is None else f"{username} -- {mention} -- {time} (Delete) -- [Response: {reference}] -- {languages} => {message}"), *files],
+            "role": "user",
+        }
+
+    @classmethod
+    async def handle_message(cls, channel_id: int, message: str, username: str, mention: str, files: list[AttachmentRef], reference: str | None, time: str, languages: str) -> dict[str, list[str | types.Part]]:
+        return await cls.generate_response(channel_id, cls.build_message(message, username, mention, files, reference, time, languages))
+
+    @classmethod
+    async def prepare_history(cls, channel_id: int, message: dict[str, list[str | types.Part]], message_id: int | None = None, content: str | None = None) -> list[dict[str, list[str | types.Part]]]:
+        history = cls.message_history[channel_id]
+        await cls.classify(channel_id, message, content)
+        history.append(message, message_id)
+        await history.compact()
+        contents = history.contents()
+        metrics.set_gauge("history_turns", len(contents), channel=str(channel_id))
+        metrics.set_gauge("history_tokens", history.estimated_tokens + len(history.summary) // 4, channel=str(channel_id))
+        return await attachment_store.load_contents(contents)
+
+    @classmethod
+    async def generate_response(cls, channel_id: int, message: dict[str, list[str | types.Part]], message_id: int | None = None, content: str | None = None) -> dict[str, list[str | types.Part]]:
+        contents = await cls.prepare_history(channel_id, message, message_id, content)
+        with metrics.span("generate"):
+            response = await generate_content(contents, response_schema, SYSTEM_MESSAGE)
         result = response.candidates[0].content.model_dump()
-        cls.message_history.append(result)
+        cls.message_history[channel_id].append(result)
         return response.parsed
 
     @classmethod
-    def classify(cls, message: dict[str, list[str | types.Part]]) -> None:
-        cls.classifier_message_history.append(message)
-        response: types.GenerateContentResponse = client.models.generate_content(
-            contents=cls.classifier_message_history,
-            model="gemini-2.0-flash-exp",
-            config=types.GenerateContentConfig(
-                response_mime_type="application/json",
-                response_schema=classifier_schema,
-                system_instruction=CLASSIFIER_SYSTEM_MESSAGE,
-            )
-        )
-        result = response.candidates[0].content.model_dump()
-        cls.classifier_message_history.append(result)
-        parsed = response.parsed
-        for query in parsed["search_queries"]:
-            for url in search(query, num_results=30):
+    async def stream_response(cls, channel_id: int, message: dict[str, list[str | types.Part]], message_id: int | None = None, content: str | None = None) -> AsyncIterator[tuple[str, Any]]:
+        # Yields ("introduction", str) and ("step", dict) as soon as the model finishes writing
+        # them, and ("response", dict) with the whole answer at the end.
+        contents = await cls.prepare_history(channel_id, message, message_id, content)
+        parser = JsonStreamParser()
+        text = ""
+        # Only the time spent waiting on the model counts, not the time the caller takes to
+        # send each event.
+        generating = 0.0
+        waiting_since = perf_counter()
+        async for chunk in generate_content_stream(contents, response_schema, SYSTEM_MESSAGE):
+            generating += perf_counter() - waiting_since
+            text += chunk.text or ""
+            for path, value in parser.feed(chunk.text or ""):
+                if path == ("introduction",):
+                    yield "introduction", value
+                elif len(path) == 2 and path[0] == "steps":
+                    yield "step", value
+            waiting_since = perf_counter()
+        generating += perf_counter() - waiting_since
+        metrics.observe("generate", generating)
+        cls.message_history[channel_id].append({
+            "parts": [types.Part.from_text(text)],
+            "role": "model",
+        })
+        yield "response", json.loads(text)
+
+    @classmethod
+    async def classify(cls, channel_id: int, message: dict[str, list[str | types.Part]], content: str | None = None) -> None:
+        # content is what the user wrote, without the name, date and reply quoted in the turn.
+        history = cls.message_history[channel_id]
+        classifier_history = cls.classifier_message_history[channel_id]
+        classifier_history.append(message)
+        text = "\n".join(get_part_text(part) or "" for part in message["parts"])
+        parsed = pre_classify(text)
+        if parsed is None:
+            await classifier_history.compact()
+            with metrics.span("classify"):
+                response = await generate_content(await attachment_store.load_contents(classifier_history.contents()), classifier_schema, CLASSIFIER_SYSTEM_MESSAGE)
+            result = response.candidates[0].content.model_dump()
+            classifier_history.append(result)
+            parsed = response.parsed
+            for video in extract_youtube_links(text):
+                if video not in parsed["youtube_video_links"]:
+                    parsed["youtube_video_links"].append(video)
+        # Searches and page fetches for every query run concurrently.
+        with metrics.span("search"):
+            results = await asyncio.gather(*(search_urls(query) for query in parsed["search_queries"]))
+        pages_to_fetch: dict[str, tuple[str, str]] = {}
+        for query, urls in zip(parsed["search_queries"], results):
+            for url in urls:
                 if url.startswith("https://www.youtube.com"):
                     parsed["youtube_video_links"].append(url)
-                if url.startswith("https://github.com"):
-                    html = requests.get(url).text
-                    cls.message_history.append({
-                        "parts": [types.Part.from_text(f"INTERNET_SEARCH -- {query} -- GitHub => {html}")],
-                        "role": "user",
-                    })
-                if url.startswith("https://stackoverflow.com"):
-                    html = requests.get(url).text
-                    cls.message_history.append({
-                        "parts": [types.Part.from_text(f"INTERNET_SEARCH -- {query} -- StackOverflow => {html}")],
-                        "role": "user",
-                    })
-                if url.startswith("https://es.wikipedia.org") or url.startswith("https://en.wikipedia.org"):
-                    html = requests.get(url).text
-                    cls.message_history.append({
-                        "parts": [types.Part.from_text(f"INTERNET_SEARCH -- {query} -- Wikipedia => {html}")],
-                        "role": "user",
-                    })
-        video_parts = {}
-        for video in parsed["youtube_video_links"]:
-            video_parts[video] = None
-            try:
-                duration = subprocess.run(["yt-dlp", "--get-duration", video], check=True, capture_output=True, text=True).stdout
-                # Check the video is less than 3 minutes long
-                colon_count = duration.count(":")
-                if colon_count == 1:
-                    minutes, seconds = map(int, duration.split(":"))
-                    if minutes >= 3:
-                        continue
-                elif colon_count == 2:
-                    hours, minutes, seconds = map(int, duration.split(":"))
-                    if hours >= 1 or minutes >= 3:
-                        continue
-                # mp4 format
-                subprocess.run(["yt-dlp", video, "-o", "temp", "--format", "bestvideo[ext=mp4]+bestaudio[ext=m4a]/best[ext=mp4]"], check=True)
-                with open("temp.mp4", "rb") as f:
-                    if os.stat("temp.mp4").st_size >= 20971520:
-                        continue
-                    video_parts[video] = types.Part.from_bytes(f.read(), "video/mp4")
-                os.remove("temp.mp4")
-            except subprocess.CalledProcessError:
-                pass
-        for video, part in video_parts.items():
-            cls.message_history.append({
+                source = get_source(url)
+                if source is not None and url not in pages_to_fetch:
+                    pages_to_fetch[url] = (query, source)
+        with metrics.span("fetch_pages"):
+            texts = await fetch_pages(list(pages_to_fetch))
+        fetched_urls = []
+        for (url, (query, source)), page_text in zip(pages_to_fetch.items(), texts):
+            if page_text:
+                await asyncio.to_thread(passage_index.add_document, url, source, page_text)
+                fetched_urls.append(url)
+        # Only the passages that best match the question enter the prompt, not whole pages.
+        question = MENTION_PATTERN.sub(" ", content if content is not None else text)
+        passages = await asyncio.to_thread(passage_index.search, " ".join([*parsed["search_queries"], question]), fetched_urls)
+        for passage in passages:
+            history.append({
+                "parts": [types.Part.from_text(f"INTERNET_SEARCH -- {pages_to_fetch[passage.url][0]} -- {passage.source} => {passage.text}")],
+                "role": "user",
+            })
+        videos = list(dict.fromkeys(parsed["youtube_video_links"]))
+        with metrics.span("youtube"):
+            video_refs = await asyncio.gather(*(get_video_ref(video) for video in videos))
+        for video, part in zip(videos, video_refs):
+            history.append({
                 "parts": [types.Part.from_text(f"INTERNET_SEARCH -- {video} -- YouTube => Resultado de video" if part is not None else f"INTERNET_SEARCH -- {video} -- YouTube => No se pudo obtener el video")] + ([part] if part is not None else []),
                 "role": "user",
             })
 
     @classmethod
-    def append_message_history(cls, message: str, username: str, mention: str, files: list[types.Part], reference: str | None, time: str, languages: str) -> None:
-        cls.message_history.append({
-            "parts": [types.Part.from_text(f"{username} -- {mention} -- {time} -- {languages} => {message}" if reference is None else f"{username} -- {mention} -- {time} -- [Response: {reference}] -- {languages} => {message}"), *files],
-            "role": "user",
-        })
+    def append_message_history(cls, channel_id: int, message_id: int, message: str, username: str, mention: str, files: list[AttachmentRef], reference: str | None, time: str, languages: str) -> None:
+        cls.message_history[channel_id].append(cls.build_message(message, username, mention, files, reference, time, languages), message_id)
 
     @classmethod
-    def append_message_history_edit(cls, old_message: str, new_message: str, username: str, mention: str, files: list[types.Part], reference: str | None, time: str, languages: str) -> None:
-        cls.message_history.append({
-            "parts": [types.Part.from_text(f"{username} -- {mention} -- {time} (Edit) -- {languages} => {old_message} => {new_message}" if reference is None else f"{username} -- {mention} -- {time} (Edit) -- [Response: {reference}] -- {languages} => {old_message} => {new_message}"), *files],
-            "role": "user",
+    def append_cached_response(cls, channel_id: int, message_id: int, message: dict[str, list[str | types.Part]], response: dict[str, Any]) -> None:
+        # A question answered from the cache still enters the history with its answer.
+        history = cls.message_history[channel_id]
+        history.append(message, message_id)
+        history.append({
+            "parts": [types.Part.from_text(json.dumps(response, ensure_ascii=False))],
+            "role": "model",
         })
+
+    @classmethod
+    def append_message_history_edit(cls, channel_id: int, message_id: int, old_message: str, new_message: str, username: str, mention: str, files: list[AttachmentRef], reference: str | None, time: str, languages: str) -> None:
+        # The original turn becomes the edit, so edits do not grow the history; only messages
+        # that are no longer in it get a turn of their own.
+        history = cls.message_history[channel_id]
+        turn = cls.build_edit_message(old_message, new_message, username, mention, files, reference, time, languages)
+        if not history.replace(message_id, turn):
+            history.append(turn, message_id)
     
     @classmethod
-    def append_message_history_delete(cls, message: str, username: str, mention: str, files: list[types.Part], reference: str | None, time: str, languages: str) -> None:
-        cls.message_history.append({
-            "parts": [types.Part.from_text(f"{username} -- {mention} -- {time} (Delete) -- {languages} => {message}" if reference is None else f"{username} -- {mention} -- {time} (Delete) -- [Response: {reference}] -- {languages} => {message}"), *files],
-            "role": "user",
-        })
+    def append_message_history_delete(cls, channel_id: int, message_id: int, message: str, username: str, mention: str, reference: str | None, time: str, languages: str) -> None:
+        # The turn is left as a tombstone without its attachments. A deleted message the
+        # history does not hold is not worth a turn.
+        cls.message_history[channel_id].replace(message_id, cls.build_delete_message(message, username, mention, [], reference, time, languages))
     
     @classmethod
-    def handle_edit_message(cls, old_message: str, new_message: str, username: str, mention: str, files: list[types.Part], reference: str | None, time: str, languages: str) -> dict[str, list[str | types.Part]]:
-        message = {
-            "parts": [types.Part.from_text(f"{username} -- {mention} -- {time} (Edit) -- {languages} => {old_message} => {new_message}" if reference is None else f"{username} -- {mention} -- {time} (Edit) -- [Response: {reference}] -- {languages} => {old_message} => {new_message}"), *files],
-            "role": "user",
-        }
-        cls.classify(message)
-        cls.message_history.append(message)
-        response = client.models.generate_content(
-            contents=cls.message_history,
-            model="gemini-2.0-flash-exp",
-            config=types.GenerateContentConfig(
-                response_mime_type="application/json",
-                response_schema=response_schema,
-                system_instruction=SYSTEM_MESSAGE,
-            )
-        )
-        result = response.candidates[0].content.model_dump()
-        cls.message_history.append(result)
-        return response.parsed
+    async def handle_edit_message(cls, channel_id: int, old_message: str, new_message: str, username: str, mention: str, files: list[AttachmentRef], reference: str | None, time: str, languages: str) -> dict[str, list[str | types.Part]]:
+        return await cls.generate_response(channel_id, cls.build_edit_message(old_message, new_message, username, mention, files, reference, time, languages))
     
     @classmethod
-    def handle_delete_message(cls, message: str, username: str, mention: str, files: list[types.Part], reference: str | None, time: str, languages: str) -> dict[str, list[str | types.Part]]:
-        message = {
-            "parts": [types.Part.from_text(f"{username} -- {mention} -- {time} (Delete) -- {languages} => {message}" if reference is None else f"{username} -- {mention} -- {time} (Delete) -- [Response: {reference}] -- {languages} => {message}"), *files],
-            "role": "user",
-        }
-        cls.classify(message)
-        cls.message_history.append(message)
-        response = client.models.generate_content(
-            contents=cls.message_history,
-            model="gemini-2.0-flash-exp",
-            config=types.GenerateContentConfig(
-                response_mime_type="application/json",
-                response_schema=response_schema,
-                system_instruction=SYSTEM_MESSAGE,
-            )
-        )
-        result = response.candidates[0].content.model_dump()
-        cls.message_history.append(result)
-        return response.parsed
\ No newline at end of file
+    async def handle_delete_message(cls, channel_id: int, message: str, username: str, mention: str, files: list[AttachmentRef], reference: str | None, time: str, languages: str) -> dict[str, list[str | types.Part]]:
+        return await cls.generate_response(channel_id, cls.build_delete_message(message, username, mention, files, reference, time, languages))
@@ -0,0 +1,151 @@
+import asyncio
+import os
+from collections import defaultdict
+from typing import Any
+
+from google.genai import types
+
+from the_math_guys_bot.ai.engine import count_tokens, generate_content
+from the_math_guys_bot.ai.youtube import VIDEO_TOKENS_PER_SECOND, VideoRef
+from the_math_guys_bot.utils.attachment_store import AttachmentRef
+
+
+HISTORY_TOKEN_BUDGET: int = int(os.getenv("HISTORY_TOKEN_BUDGET", "100000"))
+CLASSIFIER_HISTORY_TOKEN_BUDGET: int = int(os.getenv("CLASSIFIER_HISTORY_TOKEN_BUDGET", "20000"))
+# Share of the budget kept verbatim after a compaction, the rest is folded into the summary.
+HISTORY_KEEP_RATIO: float = float(os.getenv("HISTORY_KEEP_RATIO", "0.5"))
+# Share of the budget the local estimate must reach before Gemini is asked for the real count.
+HISTORY_COUNT_RATIO: float = float(os.getenv("HISTORY_COUNT_RATIO", "0.8"))
+# Gemini bills a fixed amount of tokens per image, and we use it as the estimate for any attachment.
+ATTACHMENT_TOKEN_ESTIMATE: int = 258
+
+
+SUMMARY_SYSTEM_MESSAGE: str = """- Eres el encargado de resumir conversaciones del servidor de Discord The math guys.
+- Recibirás un resumen previo, que puede estar vacío, seguido de los mensajes más antiguos de la conversación. Debes devolver un único resumen actualizado en texto plano.
+- El resumen debe conservar los nombres y menciones <@ID_DEL_USUARIO> de los usuarios, las preguntas que se hicieron, las respuestas que se dieron, los datos importantes y las tareas que se pidieron.
+- Sé lo más breve posible sin perder información necesaria para continuar la conversación."""
+
+
+def get_part_text(part: str | types.Part | dict[str, Any]) -> str | None:
+    if isinstance(part, str):
+        return part
+    if isinstance(part, dict):
+        return part.get("text")
+    return getattr(part, "text", None)
+
+
+def estimate_tokens(turn: dict[str, Any]) -> int:
+    tokens = 0
+    for part in turn["parts"]:
+        if isinstance(part, VideoRef):
+            tokens += int(part.duration * VIDEO_TOKENS_PER_SECOND)
+            continue
+        text = get_part_text(part)
+        tokens += len(text) // 4 + 1 if text is not None else ATTACHMENT_TOKEN_ESTIMATE
+    return tokens
+
+
+class ChannelHistory:
+    def __init__(self, token_budget: int) -> None:
+        self.token_budget = token_budget
+        self.summary: str = ""
+        self.turns: list[dict[str, Any]] = []
+        # Discord message ID -> its turn, for the turns still in self.turns.
+        self.message_turns: dict[int, dict[str, Any]] = {}
+        self.estimated_tokens: int = 0
+        self.lock = asyncio.Lock()
+        self.compaction: asyncio.Task | None = None
+
+    def append(self, turn: dict[str, Any], message_id: int | None = None) -> None:
+        self.turns.append(turn)
+        if message_id is not None:
+            self.message_turns[message_id] = turn
+        self.estimated_tokens += estimate_tokens(turn)
+        # Channels that are never mentioned would otherwise grow forever, so they get
+        # compacted in the background once they are well over the budget.
+        if self.estimated_tokens > 2 * self.token_budget and (self.compaction is None or self.compaction.done()):
+            self.compaction = asyncio.create_task(self.compact())
+
+    def replace(self, message_id: int, turn: dict[str, Any]) -> bool:
+        # Rewrites the message's turn where it stands. Returns False when the message is not in
+        # the history, because it was never seen or has been folded into the summary.
+        current = self.message_turns.get(message_id)
+        if current is None:
+            return False
+        self.estimated_tokens += estimate_tokens(turn) - estimate_tokens(current)
+        current["parts"] = turn["parts"]
+        return True
+
+    def contents(self) -> list[dict[str, Any]]:
+        if not self.summary:
+            return list(self.turns)
+        return [{
+            "parts": [types.Part.from_text(f"RESUMEN_DE_CONVERSACION => {self.summary}")],
+            "role": "user",
+        }, *self.turns]
+
+    async def count_tokens(self) -> int:
+        # Attachments and videos are only references until generation, so they are counted
+        # with the local estimate instead of being loaded just to be measured.
+        contents = []
+        reference_tokens = 0
+        for turn in self.contents():
+            parts = [part for part in turn["parts"] if not isinstance(part, (AttachmentRef, VideoRef))]
+            reference_tokens += estimate_tokens({"parts": [part for part in turn["parts"] if isinstance(part, (AttachmentRef, VideoRef))]})
+            if parts:
+                contents.append({**turn, "parts": parts})
+        # This runs with the history locked, before the answer is generated, so a failed or slow
+        # count falls back to the local estimate.
+        try:
+            return await count_tokens(contents) + reference_tokens
+        except Exception as e:
+            print(f"Could not count history tokens, using the estimate: {e!r}")
+            return self.estimated_tokens + len(self.summary) // 4
+
+    async def compact(self) -> None:
+        async with self.lock:
+            if self.estimated_tokens + len(self.summary) // 4 <= self.token_budget * HISTORY_COUNT_RATIO:
+                return
+            total_tokens = await self.count_tokens()
+            if total_tokens <= self.token_budget:
+                return
+            # Scale the local estimates to the real count so we know how many turns to fold.
+            scale = total_tokens / max(self.estimated_tokens + len(self.summary) // 4, 1)
+            kept_tokens = 0
+            split = len(self.turns) - 1
+            while split > 0:
+                turn_tokens = estimate_tokens(self.turns[split - 1]) * scale
+                if kept_tokens + turn_tokens > self.token_budget * HISTORY_KEEP_RATIO:
+                    break
+                kept_tokens += turn_tokens
+                split -= 1
+            folded = self.turns[:split]
+            if not folded:
+                return
+            try:
+                self.summary = await summarize(self.summary, folded)
+            except Exception as e:
+                print(f"Could not summarize history, dropping {len(folded)} turns: {e}")
+            # New turns are only ever appended at the end, so the folded prefix is still in place.
+            del self.turns[:split]
+            folded_turns = {id(turn) for turn in folded}
+            self.message_turns = {message_id: turn for message_id, turn in self.message_turns.items() if id(turn) not in folded_turns}
+            self.estimated_tokens = sum(estimate_tokens(turn) for turn in self.turns)
+
+
+async def summarize(summary: str, turns: list[dict[str, Any]]) -> str:
+    lines = []
+    for turn in turns:
+        for part in turn["parts"]:
+            text = get_part_text(part)
+            lines.append(f"{turn['role']}: {text}" if text is not None else f"{turn['role']}: [archivo adjunto]")
+    response = await generate_content([{
+        "parts": [types.Part.from_text(f"RESUMEN_PREVIO => {summary}\n\nMENSAJES =>\n" + "\n".join(lines))],
+        "role": "user",
+    }], None, SUMMARY_SYSTEM_MESSAGE)
+    return response.text
+
+
+class HistoryStore(defaultdict[int, ChannelHistory]):
+    def __init__(self, token_budget: int) -> None:
+        super().__init__(lambda: ChannelHistory(token_budget))
@@ -0,0 +1,98 @@
+import os
+import re
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import NamedTuple
+
+
+PASSAGE_INDEX_PATH: Path = Path(os.getenv("PASSAGE_INDEX_PATH", "passages.db"))
+PASSAGE_CHARACTERS: int = int(os.getenv("PASSAGE_CHARACTERS", "1000"))
+PASSAGE_TOP_K: int = int(os.getenv("PASSAGE_TOP_K", "8"))
+PASSAGE_TOKEN_BUDGET: int = int(os.getenv("PASSAGE_TOKEN_BUDGET", "4000"))
+PASSAGE_MAX_AGE: float = float(os.getenv("PASSAGE_MAX_AGE_DAYS", "7")) * 86400
+MAX_QUERY_TERMS: int = 64
+
+
+class Passage(NamedTuple):
+    url: str
+    source: str
+    text: str
+
+
+def split_passages(text: str) -> list[str]:
+    passages = []
+    current = ""
+    for line in text.split("\n"):
+        # Lines longer than a passage are cut at sentence ends, or hard-cut if there are none.
+        while len(line) > PASSAGE_CHARACTERS:
+            cut = line.rfind(". ", 0, PASSAGE_CHARACTERS)
+            cut = cut + 1 if cut > 0 else PASSAGE_CHARACTERS
+            passages.append(line[:cut].strip())
+            line = line[cut:]
+        if len(current) + len(line) + 1 > PASSAGE_CHARACTERS and current:
+            passages.append(current.strip())
+            current = ""
+        current += line + "\n"
+    if current.strip():
+        passages.append(current.strip())
+    return [passage for passage in passages if passage]
+
+
+def build_match_query(text: str) -> str | None:
+    terms = list(dict.fromkeys(term for term in re.findall(r"\w+", text.lower()) if len(term) > 1))[:MAX_QUERY_TERMS]
+    if not terms:
+        return None
+    return " OR ".join(f'"{term}"' for term in terms)
+
+
+class PassageIndex:
+    # BM25 over the passages of every fetched page, through SQLite's FTS5 inverted index.
+    def __init__(self, path: Path) -> None:
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.lock = threading.Lock()
+        with self.lock, self.connection:
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            self.connection.execute("CREATE TABLE IF NOT EXISTS documents (url TEXT PRIMARY KEY, indexed_at REAL NOT NULL)")
+            self.connection.execute("CREATE VIRTUAL TABLE IF NOT EXISTS passages USING fts5(text, url UNINDEXED, source UNINDEXED, tokenize='unicode61 remove_diacritics 2')")
+
+    def add_document(self, url: str, source: str, text: str) -> None:
+        now = time.time()
+        with self.lock, self.connection:
+            row = self.connection.execute("SELECT indexed_at FROM documents WHERE url = ?", (url,)).fetchone()
+            if row is not None and now - row[0] <= PASSAGE_MAX_AGE:
+                return
+            self.connection.execute("DELETE FROM passages WHERE url = ?", (url,))
+            self.connection.executemany("INSERT INTO passages (text, url, source) VALUES (?, ?, ?)", ((passage, url, source) for passage in split_passages(text)))
+            self.connection.execute("INSERT OR REPLACE INTO documents (url, indexed_at) VALUES (?, ?)", (url, now))
+            self.evict(now)
+
+    def evict(self, now: float) -> None:
+        expired = [url for url, in self.connection.execute("SELECT url FROM documents WHERE indexed_at < ?", (now - PASSAGE_MAX_AGE,))]
+        for url in expired:
+            self.connection.execute("DELETE FROM passages WHERE url = ?", (url,))
+            self.connection.execute("DELETE FROM documents WHERE url = ?", (url,))
+
+    def search(self, text: str, urls: list[str], top_k: int = PASSAGE_TOP_K, token_budget: int = PASSAGE_TOKEN_BUDGET) -> list[Passage]:
+        match_query = build_match_query(text)
+        if match_query is None or not urls:
+            return []
+        with self.lock:
+            rows = self.connection.execute(
+                f"SELECT url, source, text FROM passages WHERE passages MATCH ? AND url IN ({', '.join('?' * len(urls))}) ORDER BY bm25(passages) LIMIT ?",
+                (match_query, *urls, top_k),
+            ).fetchall()
+        passages = []
+        tokens = 0
+        for row in rows:
+            passage = Passage(*row)
+            # Same rough estimate as the history: four characters per token.
+            tokens += len(passage.text) // 4 + 1
+            if tokens > token_budget:
+                break
+            passages.append(passage)
+        return passages
+
+
+passage_index = PassageIndex(PASSAGE_INDEX_PATH)
@@ -0,0 +1,41 @@
+import os
+import re
+
+from the_math_guys_bot.utils.metrics import metrics
+
+
+LOCAL_PRE_CLASSIFIER: bool = os.getenv("LOCAL_PRE_CLASSIFIER", "1") == "1"
+
+
+YOUTUBE_LINK_PATTERN = re.compile(r"https?://(?:www\.|m\.)?(?:youtube\.com/(?:watch\?\S*?v=|shorts/|live/)|youtu\.be/)[\w-]{11}\S*", re.IGNORECASE)
+URL_PATTERN = re.compile(r"https?://\S+", re.IGNORECASE)
+# Words that suggest the answer depends on something the model may not know: recent events,
+# prices, documentation, or an explicit request to look something up.
+SEARCH_CUES_PATTERN = re.compile(r"\b(?:" + "|".join([
+    r"busca\w*", r"googlea\w*", r"google", r"internet", r"web", r"links?", r"enlaces?", r"fuentes?",
+    r"noticias?", r"actual(?:es|mente)?", r"hoy", r"ayer", r"[úu]ltim[oa]s?", r"recientes?",
+    r"precios?", r"cotizaci[óo]n", r"clima", r"documentaci[óo]n", r"versi[óo]n", r"lanzamiento",
+    r"qui[ée]n es", r"github", r"stack ?overflow", r"wikipedia",
+    r"search\w*", r"look up", r"latest", r"news", r"today", r"yesterday", r"current(?:ly)?", r"recent(?:ly)?",
+    r"prices?", r"weather", r"docs", r"documentation", r"version", r"release[sd]?", r"who is",
+]) + r")\b", re.IGNORECASE)
+
+
+def extract_youtube_links(text: str) -> list[str]:
+    return list(dict.fromkeys(match.group(0) for match in YOUTUBE_LINK_PATTERN.finditer(text)))
+
+
+def pre_classify(text: str) -> dict[str, list[str]] | None:
+    # Returns the classification when the message clearly needs no search, and None when
+    # the LLM classifier has to decide (and write the queries).
+    if not LOCAL_PRE_CLASSIFIER:
+        metrics.increment("pre_classifier", result="delegated")
+        return None
+    youtube_video_links = extract_youtube_links(text)
+    other_links = [url for url in URL_PATTERN.findall(text) if not YOUTUBE_LINK_PATTERN.match(url)]
+    if other_links or SEARCH_CUES_PATTERN.search(text):
+        metrics.increment("pre_classifier", result="delegated")
+        return None
+    metrics.increment("pre_classifier", result="skipped")
+    return {"search_queries": [], "youtube_video_links": youtube_video_links}
+
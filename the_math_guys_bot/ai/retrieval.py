@@ -0,0 +1,155 @@
+import asyncio
+import hashlib
+import json
+import os
+import re
+from collections import defaultdict
+from html.parser import HTMLParser
+from pathlib import Path
+from urllib.parse import urlparse
+
+import aiohttp
+from googlesearch import search
+
+from the_math_guys_bot.utils.disk_cache import DiskCache
+from the_math_guys_bot.utils.metrics import metrics
+
+
+SEARCH_RESULTS: int = 30
+PAGE_CACHE_DIR: Path = Path(os.getenv("PAGE_CACHE_DIR", "page_cache"))
+PAGE_CACHE_MAX_BYTES: int = int(os.getenv("PAGE_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+PAGE_CACHE_TTL: float = float(os.getenv("PAGE_CACHE_TTL_HOURS", "24")) * 3600
+FETCH_TIMEOUT: float = float(os.getenv("FETCH_TIMEOUT", "10"))
+MAX_CONNECTIONS: int = int(os.getenv("MAX_CONNECTIONS", "16"))
+MAX_CONNECTIONS_PER_HOST: int = int(os.getenv("MAX_CONNECTIONS_PER_HOST", "2"))
+MAX_PAGE_CHARACTERS: int = int(os.getenv("MAX_PAGE_CHARACTERS", "100000"))
+MAX_PAGE_BYTES: int = 5 * 1024 * 1024
+
+
+SOURCES: dict[str, str] = {
+    "https://github.com": "GitHub",
+    "https://stackoverflow.com": "StackOverflow",
+    "https://es.wikipedia.org": "Wikipedia",
+    "https://en.wikipedia.org": "Wikipedia",
+}
+
+
+page_cache = DiskCache(PAGE_CACHE_DIR, PAGE_CACHE_MAX_BYTES, PAGE_CACHE_TTL)
+host_semaphores: defaultdict[str, asyncio.Semaphore] = defaultdict(lambda: asyncio.Semaphore(MAX_CONNECTIONS_PER_HOST))
+session: aiohttp.ClientSession | None = None
+
+
+class MainTextExtractor(HTMLParser):
+    # Keeps the readable text of a page and drops scripts, styles and navigation chrome.
+    # If the page has a <main> or <article>, only the text inside it is kept.
+    SKIPPED_TAGS = {"script", "style", "noscript", "svg", "nav", "header", "footer", "aside", "form", "button", "iframe", "template"}
+    MAIN_TAGS = {"main", "article"}
+    BLOCK_TAGS = {"p", "div", "section", "li", "ul", "ol", "pre", "table", "tr", "h1", "h2", "h3", "h4", "h5", "h6", "br", "blockquote", "dd", "dt"}
+    VOID_TAGS = {"area", "base", "br", "col", "embed", "hr", "img", "input", "link", "meta", "source", "track", "wbr"}
+
+    def __init__(self) -> None:
+        super().__init__(convert_charrefs=True)
+        self.skip_depth = 0
+        self.main_depth = 0
+        self.text: list[str] = []
+        self.main_text: list[str] = []
+
+    def handle_starttag(self, tag: str, attrs: list[tuple[str, str | None]]) -> None:
+        if tag in self.VOID_TAGS:
+            if tag == "br":
+                self.add_text("\n")
+            return
+        if tag in self.SKIPPED_TAGS:
+            self.skip_depth += 1
+        if tag in self.MAIN_TAGS:
+            self.main_depth += 1
+        if tag in self.BLOCK_TAGS:
+            self.add_text("\n")
+
+    def handle_endtag(self, tag: str) -> None:
+        if tag in self.SKIPPED_TAGS and self.skip_depth > 0:
+            self.skip_depth -= 1
+        if tag in self.MAIN_TAGS and self.main_depth > 0:
+            self.main_depth -= 1
+        if tag in self.BLOCK_TAGS:
+            self.add_text("\n")
+
+    def handle_data(self, data: str) -> None:
+        self.add_text(data)
+
+    def add_text(self, data: str) -> None:
+        if self.skip_depth > 0:
+            return
+        self.text.append(data)
+        if self.main_depth > 0:
+            self.main_text.append(data)
+
+
+def extract_main_text(html: str) -> str:
+    extractor = MainTextExtractor()
+    extractor.feed(html)
+    extractor.close()
+    text = "".join(extractor.main_text if "".join(extractor.main_text).strip() else extractor.text)
+    text = re.sub(r"[ \t\r\f\v]+", " ", text)
+    return re.sub(r"\s*\n\s*", "\n", text).strip()
+
+
+def get_source(url: str) -> str | None:
+    for prefix, source in SOURCES.items():
+        if url.startswith(prefix):
+            return source
+    return None
+
+
+def get_session() -> aiohttp.ClientSession:
+    global session
+    if session is None or session.closed:
+        session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=MAX_CONNECTIONS, limit_per_host=MAX_CONNECTIONS_PER_HOST),
+            timeout=aiohttp.ClientTimeout(total=FETCH_TIMEOUT),
+            headers={"User-Agent": "Mozilla/5.0 (compatible; TheMathGuysBot)"},
+        )
+    return session
+
+
+async def close_session() -> None:
+    if session is not None and not session.closed:
+        await session.close()
+
+
+async def search_urls(query: str) -> list[str]:
+    key = hashlib.sha256(f"search\0{query}".encode()).hexdigest()
+    cached = page_cache.get_bytes(key)
+    if cached is not None:
+        return json.loads(cached)
+    # googlesearch is blocking, so it runs in a worker thread.
+    urls = await asyncio.to_thread(lambda: list(search(query, num_results=SEARCH_RESULTS)))
+    await asyncio.to_thread(page_cache.put_bytes, key, json.dumps(urls).encode())
+    return urls
+
+
+async def fetch_page(url: str) -> str | None:
+    key = hashlib.sha256(f"page\0{url}".encode()).hexdigest()
+    cached = page_cache.get_bytes(key)
+    if cached is not None:
+        return cached.decode()
+    try:
+        async with host_semaphores[urlparse(url).netloc]:
+            async with get_session().get(url) as response:
+                response.raise_for_status()
+                body = bytearray()
+                async for chunk in response.content.iter_chunked(64 * 1024):
+                    body.extend(chunk)
+                    if len(body) >= MAX_PAGE_BYTES:
+                        break
+                html = body.decode(response.charset or "utf-8", errors="replace")
+        metrics.increment("downloaded_bytes", len(body), source="web")
+    except (aiohttp.ClientError, asyncio.TimeoutError, LookupError):
+        return None
+    text = (await asyncio.to_thread(extract_main_text, html))[:MAX_PAGE_CHARACTERS]
+    await asyncio.to_thread(page_cache.put_bytes, key, text.encode())
+    return text
+
+
+async def fetch_pages(urls: list[str]) -> list[str | None]:
+    return await asyncio.gather(*(fetch_page(url) for url in urls))
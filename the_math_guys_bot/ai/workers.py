@@ -0,0 +1,212 @@
+import asyncio
+import inspect
+import itertools
+import multiprocessing
+import os
+import pickle
+import threading
+from typing import Any, AsyncIterator
+
+from google.genai import types
+
+from the_math_guys_bot.utils.metrics import metrics
+
+
+# 0 keeps everything in the bot's process.
+WORKER_PROCESSES: int = int(os.getenv("WORKER_PROCESSES", "0"))
+WORKER_CHECK_INTERVAL: float = 5
+
+
+def send_result(results: multiprocessing.Queue, job_id: int | None, kind: str, value: Any) -> None:
+    # Pickled here rather than by the queue's feeder thread, which would only print the error.
+    try:
+        data = pickle.dumps((job_id, kind, value))
+    except Exception:
+        data = pickle.dumps((job_id, "error", RuntimeError(repr(value))))
+    results.put(data)
+
+
+def flush_metrics(results: multiprocessing.Queue) -> None:
+    if metrics.forwarded:
+        send_result(results, None, "metrics", metrics.forwarded)
+        metrics.forwarded = []
+
+
+async def run_job(handler: Any, job_id: int, method: str, channel_id: int, args: tuple[Any, ...], results: multiprocessing.Queue) -> None:
+    try:
+        result = getattr(handler, method)(channel_id, *args)
+        if inspect.isasyncgen(result):
+            async for event in result:
+                send_result(results, job_id, "event", event)
+        else:
+            send_result(results, job_id, "event", await result)
+        send_result(results, job_id, "done", None)
+    except Exception as e:
+        send_result(results, job_id, "error", e)
+    finally:
+        flush_metrics(results)
+
+
+async def serve(jobs: multiprocessing.Queue, results: multiprocessing.Queue) -> None:
+    from the_math_guys_bot.ai.handle_message import HandleMessage
+
+    metrics.forwarded = []
+    running: dict[int, asyncio.Task] = {}
+    while True:
+        job_id, method, channel_id, args = await asyncio.to_thread(jobs.get)
+        if method == "stop":
+            break
+        if method == "cancel":
+            if job_id in running:
+                running[job_id].cancel()
+        elif job_id is None:
+            # Posted without waiting for a result; they run in the order they were posted.
+            getattr(HandleMessage, method)(channel_id, *args)
+            flush_metrics(results)
+        else:
+            running[job_id] = asyncio.create_task(run_job(HandleMessage, job_id, method, channel_id, args, results))
+            running[job_id].add_done_callback(lambda _, job_id=job_id: running.pop(job_id, None))
+    for task in running.values():
+        task.cancel()
+
+
+def run_worker(jobs: multiprocessing.Queue, results: multiprocessing.Queue) -> None:
+    asyncio.run(serve(jobs, results))
+
+
+class WorkerPool:
+    # Worker processes each run their own HandleMessage, with its own channel histories. A
+    # channel always goes to the same worker, so its history stays in one place.
+    def __init__(self, processes: int) -> None:
+        self.size = processes
+        # Forking a process with running threads and an event loop is unsafe.
+        self.context = multiprocessing.get_context("spawn")
+        self.results = self.context.Queue()
+        self.job_queues: list[multiprocessing.Queue] = []
+        self.processes: list[multiprocessing.Process] = []
+        # Job ID -> (worker index, queue of (kind, value) results).
+        self.pending: dict[int, tuple[int, asyncio.Queue]] = {}
+        self.job_ids = itertools.count()
+        self.loop: asyncio.AbstractEventLoop | None = None
+        self.reader: threading.Thread | None = None
+        self.watchdog: asyncio.Task | None = None
+
+    def start(self) -> None:
+        if self.loop is not None:
+            return
+        self.loop = asyncio.get_running_loop()
+        for index in range(self.size):
+            self.job_queues.append(self.context.Queue())
+            self.processes.append(self.spawn(index))
+        self.reader = threading.Thread(target=self.read_results, daemon=True)
+        self.reader.start()
+        self.watchdog = asyncio.create_task(self.watch())
+
+    def spawn(self, index: int) -> multiprocessing.Process:
+        process = self.context.Process(target=run_worker, args=(self.job_queues[index], self.results), daemon=True)
+        process.start()
+        return process
+
+    def stop(self) -> None:
+        if self.loop is None:
+            return
+        self.watchdog.cancel()
+        for jobs in self.job_queues:
+            jobs.put((None, "stop", 0, ()))
+        for process in self.processes:
+            process.join(timeout=5)
+            if process.is_alive():
+                process.terminate()
+        self.results.put(None)
+        self.reader.join(timeout=5)
+
+    def read_results(self) -> None:
+        # Unpickled in this thread, so large answers do not hold up the event loop.
+        while True:
+            data = self.results.get()
+            if data is None:
+                return
+            self.loop.call_soon_threadsafe(self.deliver, *pickle.loads(data))
+
+    def deliver(self, job_id: int | None, kind: str, value: Any) -> None:
+        if kind == "metrics":
+            for method, args, labels in value:
+                getattr(metrics, method)(*args, **labels)
+        elif job_id in self.pending:
+            self.pending[job_id][1].put_nowait((kind, value))
+
+    async def watch(self) -> None:
+        while True:
+            await asyncio.sleep(WORKER_CHECK_INTERVAL)
+            for index, process in enumerate(self.processes):
+                if process.is_alive():
+                    continue
+                # The histories it held are lost, and its jobs will never finish.
+                print(f"Worker {index} exited with code {process.exitcode}, restarting it.")
+                for worker, events in self.pending.values():
+                    if worker == index:
+                        events.put_nowait(("error", RuntimeError("The worker running this job exited.")))
+                self.job_queues[index] = self.context.Queue()
+                self.processes[index] = self.spawn(index)
+
+    def get_worker(self, channel_id: int) -> int:
+        return channel_id % self.size
+
+    def post(self, channel_id: int, method: str, *args: Any) -> None:
+        self.start()
+        self.job_queues[self.get_worker(channel_id)].put((None, method, channel_id, args))
+
+    async def stream(self, channel_id: int, method: str, *args: Any) -> AsyncIterator[Any]:
+        self.start()
+        job_id = next(self.job_ids)
+        worker = self.get_worker(channel_id)
+        events: asyncio.Queue = asyncio.Queue()
+        self.pending[job_id] = (worker, events)
+        self.job_queues[worker].put((job_id, method, channel_id, args))
+        finished = False
+        try:
+            while True:
+                kind, value = await events.get()
+                if kind == "event":
+                    yield value
+                elif kind == "done":
+                    finished = True
+                    return
+                else:
+                    finished = True
+                    raise value
+        finally:
+            del self.pending[job_id]
+            # Cancelled or closed early, so the worker can stop generating.
+            if not finished:
+                self.job_queues[worker].put((job_id, "cancel", channel_id, ()))
+
+    async def call(self, channel_id: int, method: str, *args: Any) -> Any:
+        result = None
+        async for result in self.stream(channel_id, method, *args):
+            pass
+        return result
+
+
+class RemoteHandleMessage:
+    # The HandleMessage methods the AI cog uses, run by the worker that owns the channel.
+    def __init__(self, pool: WorkerPool) -> None:
+        self.pool = pool
+
+    def append_message_history(self, channel_id: int, *args: Any) -> None:
+        self.pool.post(channel_id, "append_message_history", *args)
+
+    def append_message_history_edit(self, channel_id: int, *args: Any) -> None:
+        self.pool.post(channel_id, "append_message_history_edit", *args)
+
+    def append_message_history_delete(self, channel_id: int, *args: Any) -> None:
+        self.pool.post(channel_id, "append_message_history_delete", *args)
+
+    def append_cached_response(self, channel_id: int, *args: Any) -> None:
+        self.pool.post(channel_id, "append_cached_response", *args)
+
+    async def generate_response(self, channel_id: int, *args: Any) -> dict[str, list[str | types.Part]]:
+        return await self.pool.call(channel_id, "generate_response", *args)
+
+    def stream_response(self, channel_id: int, *args: Any) -> AsyncIterator[tuple[str, Any]]:
+        return self.pool.stream(channel_id, "stream_response", *args)
@@ -0,0 +1,177 @@
+import asyncio
+import hashlib
+import json
+import os
+import re
+import tempfile
+from pathlib import Path
+from time import perf_counter
+from typing import NamedTuple
+
+from google.genai import types
+
+from the_math_guys_bot.utils.attachment_store import attachment_store
+from the_math_guys_bot.utils.disk_cache import DiskCache
+from the_math_guys_bot.utils.metrics import metrics
+
+
+VIDEO_CACHE_DIR: Path = Path(os.getenv("VIDEO_CACHE_DIR", "video_cache"))
+VIDEO_CACHE_MAX_BYTES: int = int(os.getenv("VIDEO_CACHE_MAX_BYTES", str(1024 * 1024 * 1024)))
+VIDEO_CACHE_MAX_AGE: float = float(os.getenv("VIDEO_CACHE_MAX_AGE_DAYS", "7")) * 86400
+MAX_CONCURRENT_DOWNLOADS: int = int(os.getenv("MAX_CONCURRENT_DOWNLOADS", "2"))
+DOWNLOAD_TIMEOUT: float = float(os.getenv("DOWNLOAD_TIMEOUT", "120"))
+MAX_VIDEO_DURATION: int = 180
+MAX_VIDEO_SIZE: int = 20971520
+MAX_AUDIO_SIZE: int = 4 * 1024 * 1024
+# Gemini bills about 263 tokens for each second of video, frames and audio together.
+VIDEO_TOKENS_PER_SECOND: int = 263
+
+
+VIDEO_ID_PATTERN = re.compile(r"(?:[?&]v=|youtu\.be/|/shorts/|/live/|/embed/)([\w-]{11})")
+# Progressive mp4 first, since it needs no merge. The exact size is used when YouTube reports
+# it, and the bitrate estimate otherwise, so nothing over the limit is ever downloaded.
+VIDEO_FORMAT: str = "/".join([
+    f"b[ext=mp4][filesize<{MAX_VIDEO_SIZE}]",
+    f"b[ext=mp4][filesize_approx<{MAX_VIDEO_SIZE}]",
+    f"bv*[ext=mp4][filesize<{MAX_VIDEO_SIZE - MAX_AUDIO_SIZE}]+ba[ext=m4a][filesize<{MAX_AUDIO_SIZE}]",
+    f"bv*[ext=mp4][filesize_approx<{MAX_VIDEO_SIZE - MAX_AUDIO_SIZE}]+ba[ext=m4a][filesize_approx<{MAX_AUDIO_SIZE}]",
+])
+
+
+# Rejected videos are cached as empty entries, so they are not probed again either.
+video_cache = DiskCache(VIDEO_CACHE_DIR, VIDEO_CACHE_MAX_BYTES, VIDEO_CACHE_MAX_AGE)
+download_semaphore = asyncio.Semaphore(MAX_CONCURRENT_DOWNLOADS)
+# Video key -> pending download, so a link shared twice at once is downloaded once. Each runs in
+# its own task, so a requester that is cancelled only stops its own wait.
+downloads: dict[str, asyncio.Task] = {}
+
+
+class VideoRef(NamedTuple):
+    # A video in video_cache. Only the reference is kept in the history, and the video is read
+    # back when a prompt is built.
+    video_id: str
+    duration: float
+
+
+def get_video_id(url: str) -> str | None:
+    match = VIDEO_ID_PATTERN.search(url)
+    return match.group(1) if match is not None else None
+
+
+def get_video_key(video_id: str) -> str:
+    return hashlib.sha256(f"youtube\0{video_id}".encode()).hexdigest()
+
+
+def get_duration_key(video_id: str) -> str:
+    return hashlib.sha256(f"youtube-duration\0{video_id}".encode()).hexdigest()
+
+
+def get_cached_duration(video_id: str) -> float | None:
+    # 0 for a rejected video, None when the video is not cached.
+    path = video_cache.get(get_video_key(video_id))
+    if path is None:
+        return None
+    try:
+        if path.stat().st_size == 0:
+            return 0.0
+    except FileNotFoundError:
+        return None
+    duration = video_cache.get_bytes(get_duration_key(video_id))
+    # If only the duration was evicted, the longest allowed video is assumed.
+    return float(duration) if duration is not None else float(MAX_VIDEO_DURATION)
+
+
+async def reject(video_id: str) -> float:
+    await asyncio.to_thread(video_cache.put_bytes, get_video_key(video_id), b"")
+    return 0.0
+
+
+async def run_yt_dlp(*args: str, cwd: str) -> tuple[int, bytes, bytes]:
+    start = perf_counter()
+    process = await asyncio.create_subprocess_exec("yt-dlp", *args, cwd=cwd, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE)
+    try:
+        stdout, stderr = await process.communicate()
+        return process.returncode, stdout, stderr
+    finally:
+        if process.returncode is None:
+            process.kill()
+            await process.wait()
+        metrics.increment("subprocess_seconds", perf_counter() - start, program="yt-dlp")
+
+
+async def download_in_directory(video_id: str, directory: str) -> float | None:
+    url = f"https://www.youtube.com/watch?v={video_id}"
+    # A single probe resolves both the metadata and the format. Videos that are too long print
+    # nothing, and videos with no format under the size limit fail with a format error; any
+    # other failure (network, rate limits, extractor errors) may pass, so it is not cached.
+    return_code, stdout, stderr = await run_yt_dlp(
+        "--dump-json", "--no-playlist", "--format", VIDEO_FORMAT, "--match-filter", f"duration<{MAX_VIDEO_DURATION}", url,
+        cwd=directory,
+    )
+    if return_code != 0:
+        return await reject(video_id) if b"requested format is not available" in stderr.lower() else None
+    if not stdout.strip():
+        return await reject(video_id)
+    info = json.loads(stdout.splitlines()[0])
+    if info.get("duration") is None or info["duration"] >= MAX_VIDEO_DURATION:
+        return await reject(video_id)
+    Path(directory, "info.json").write_text(json.dumps(info), encoding="utf-8")
+    return_code, _, _ = await run_yt_dlp(
+        "--load-info-json", "info.json", "--max-filesize", str(MAX_VIDEO_SIZE), "--merge-output-format", "mp4", "-o", "video.%(ext)s",
+        cwd=directory,
+    )
+    video_path = Path(directory, "video.mp4")
+    if return_code != 0 or not video_path.exists():
+        return None
+    if video_path.stat().st_size >= MAX_VIDEO_SIZE:
+        return await reject(video_id)
+    metrics.increment("downloaded_bytes", video_path.stat().st_size, source="youtube")
+    # The duration goes in first, so a cached video almost always has one.
+    await asyncio.to_thread(video_cache.put_bytes, get_duration_key(video_id), str(info["duration"]).encode())
+    await asyncio.to_thread(video_cache.put_file, get_video_key(video_id), video_path)
+    return float(info["duration"])
+
+
+async def download(video_id: str) -> float | None:
+    # Caches the video and returns its duration, 0 when it is over the limits, or None when the
+    # download failed.
+    async with download_semaphore:
+        # Every job gets its own directory, which is removed whatever happens to the job.
+        with tempfile.TemporaryDirectory(prefix="youtube-") as directory:
+            try:
+                return await asyncio.wait_for(download_in_directory(video_id, directory), DOWNLOAD_TIMEOUT)
+            except (asyncio.TimeoutError, OSError, json.JSONDecodeError):
+                return None
+
+
+async def get_video_duration(video_id: str) -> float | None:
+    key = get_video_key(video_id)
+    if key in downloads:
+        return await asyncio.shield(downloads[key])
+    duration = await asyncio.to_thread(get_cached_duration, video_id)
+    if duration is not None:
+        return duration
+    # Another requester may have started the download while the cache was read.
+    if key not in downloads:
+        downloads[key] = asyncio.create_task(download(video_id))
+        downloads[key].add_done_callback(lambda _: downloads.pop(key, None))
+    return await asyncio.shield(downloads[key])
+
+
+async def get_video_ref(url: str) -> VideoRef | None:
+    video_id = get_video_id(url)
+    if video_id is None:
+        return None
+    duration = await get_video_duration(video_id)
+    return VideoRef(video_id, duration) if duration else None
+
+
+async def load_video(ref: VideoRef) -> types.Part | None:
+    data = await asyncio.to_thread(video_cache.get_bytes, get_video_key(ref.video_id))
+    if data is None and await get_video_duration(ref.video_id):
+        # Evicted or expired since, so it was downloaded again.
+        data = await asyncio.to_thread(video_cache.get_bytes, get_video_key(ref.video_id))
+    return types.Part.from_bytes(data, "video/mp4") if data else None
+
+
+attachment_store.loaders[VideoRef] = load_video
@@ -1,337 +1,361 @@
-import datetime
-import json
+import asyncio
 import os
-import subprocess
-from typing import Any
+from pathlib import Path
+from typing import Any, AsyncIterator, Coroutine, Iterable
 
 import discord
-from discord.ext import commands, pages, tasks as discord_tasks
+from discord.ext import commands, pages
 
+from the_math_guys_bot.ai.answer_cache import ANSWER_CACHE_ENABLED, get_answer, get_answer_key, is_cacheable, put_answer
 from the_math_guys_bot.ai.handle_message import HandleMessage, client
+from the_math_guys_bot.ai.retrieval import close_session
+from the_math_guys_bot.ai.workers import WORKER_PROCESSES, RemoteHandleMessage, WorkerPool
+from the_math_guys_bot.utils.dispatcher import DISPATCH_CONCURRENCY, EDIT_DEBOUNCE, ChannelDispatcher
 from the_math_guys_bot.utils.get_images_from_message import get_files_from_message
+from the_math_guys_bot.utils.latex import latex2images
+from the_math_guys_bot.utils.message_cache import message_cache
+from the_math_guys_bot.utils.metrics import metrics
+from the_math_guys_bot.utils.scheduler import TaskScheduler
+from the_math_guys_bot.utils.task_store import task_store
 
 
-LATEX_TEMPLATE: str = """\\documentclass[preview]{{standalone}}
-\\usepackage[spanish]{{babel}}
-\\usepackage{{amsmath}}
-\\usepackage{{amssymb}}
-\\usepackage{{xcolor}}
+STREAM_RESPONSES: bool = os.getenv("STREAM_RESPONSES", "1") == "1"
+# While an answer streams in, formula steps that arrive within this many seconds share a render.
+RENDER_BATCH_WINDOW: float = float(os.getenv("RENDER_BATCH_WINDOW", "0.5"))
 
-\\definecolor{{bg}}{{HTML}}{{282B30}}
-\\definecolor{{fg}}{{HTML}}{{EBEBEB}}
 
-\\begin{{document}}
-\\pagecolor{{bg}}
-\\color{{fg}}
-$\\displaystyle {expression}$
-\\end{{document}}"""
+DEFAULT_TASK_CHANNEL_ID: int = int(os.getenv("DEFAULT_TASK_CHANNEL_ID", "1331066003638980760"))
 
 
-tasks_file = "tasks.json"
-discord_tasks_dict = {}
-if not os.path.exists(tasks_file):
-    with open(tasks_file, "w", encoding="utf-8") as f:
-        f.write(json.dumps({}, ensure_ascii=False))
-with open(tasks_file, "r", encoding="utf-8") as f:
-    tasks = json.load(f)
-
-
-def init_tasks(bot: commands.Bot, tasks: dict[str, dict[str, Any]]) -> None:
+def init_tasks(scheduler: TaskScheduler, tasks: dict[str, dict[str, Any]]) -> None:
     for task_name, task in tasks.items():
-        message_to_send = task["message_to_send"]
-        hour = task["hour"]
-        minute = task["minute"]
-        timezone = task["timezone"]
-        user_id = str(task["user_id"])
-        @discord_tasks.loop(minutes=1)
-        async def task_function():
-            now = datetime.datetime.now(datetime.timezone(datetime.timedelta(hours=timezone)))
-            if now.minute != minute or now.hour != hour:
-                return
-            channel = bot.get_channel(1331066003638980760)
-            await channel.send(message_to_send if user_id in message_to_send else f"<@{user_id}> {message_to_send}")
-        discord_task = task_function.start()
-        discord_tasks_dict[task_name] = discord_task
+        scheduler.schedule(task_name, task)
 
 
-def add_tasks(bot: commands.Bot, new_tasks: list[dict[str, Any]]) -> None:
-    for task in new_tasks:
+def apply_tasks(scheduler: TaskScheduler, tasks_to_add: list[dict[str, Any]], tasks_to_edit: list[dict[str, Any]], tasks_to_remove: list[str]) -> None:
+    changed, removed = task_store.apply(tasks_to_add, tasks_to_edit, tasks_to_remove)
+    for task in changed.values():
         print(task)
-        tasks[task["task_name"]] = task
-    with open(tasks_file, "w", encoding="utf-8") as f:
-        f.write(json.dumps(tasks, ensure_ascii=False))
-    init_tasks(bot, {task["task_name"]: task for task in new_tasks})
+    init_tasks(scheduler, changed)
+    for task_name in removed:
+        scheduler.cancel(task_name)
 
 
-def edit_tasks(bot: commands.Bot, tasks_to_edit: list[dict[str, Any]]) -> None:
-    for task in tasks_to_edit:
-        tasks[task["task_name"]] = task
-        discord_tasks_dict[task["task_name"]].cancel()
-    with open(tasks_file, "w", encoding="utf-8") as f:
-        f.write(json.dumps(tasks, ensure_ascii=False))
-    init_tasks(bot, {task["task_name"]: task for task in tasks_to_edit})
+def check_task_channel(message: discord.Message, task: dict[str, Any]) -> dict[str, Any]:
+    # The model copies whatever channel a user asks for, so a task only keeps its channel when
+    # it is in this server and the member who asked could post there themselves.
+    channel_id = task.get("channel_id")
+    if channel_id is None:
+        return task
+    channel = message.guild.get_channel_or_thread(channel_id) if message.guild is not None else None
+    if channel is None or not isinstance(message.author, discord.Member) or not channel.permissions_for(message.author).send_messages:
+        print(f"Task {task['task_name']} can't be sent to channel {channel_id}, using the default channel.")
+        return {key: value for key, value in task.items() if key != "channel_id"}
+    return task
 
 
-def remove_tasks(_: commands.Bot, tasks_to_remove: list[str]) -> None:
-    for task in tasks_to_remove:
-        tasks.pop(task)
-        discord_tasks_dict[task].cancel()
-        discord_tasks_dict.pop(task)
-    with open(tasks_file, "w", encoding="utf-8") as f:
-        f.write(json.dumps(tasks, ensure_ascii=False))
+def get_languages(member: discord.Member | discord.User) -> str:
+    # Members who left the server come back as plain users, without roles.
+    languages = [role.name for role in getattr(member, "roles", []) if role.name in ["Español", "English"]]
+    if len(languages) == 1:
+        return languages[0]
+    elif len(languages) > 1:
+        return "Español"
+    return "Lenguaje no especificado"
 
 
-def latex2image(
-    latex_expression: str,
-    image_name: str,
-) -> None:
-    with open("temp.tex", "w", encoding="utf-8") as f:
-        f.write(LATEX_TEMPLATE.format(expression=latex_expression))
-    subprocess.run(["latex", "-interaction=nonstopmode", "-shell-escape", "temp.tex"])
-    subprocess.run(["dvisvgm", "temp.dvi", "-n", "-b", "min", "-c", "1,1", "-o", image_name.replace(".png", ".svg")])
-    subprocess.run(["inkscape", image_name.replace(".png", ".svg"), "--export-type=png", "--export-height=300", "--export-filename", image_name])
+async def format_reference(message: discord.Message) -> str | None:
+    with metrics.span("reference"):
+        reference_message = await message_cache.fetch_reference(message)
+    if reference_message is None:
+        return None
+    created_at = reference_message.created_at.strftime("%d/%m/%Y;%H:%M:%S")
+    languages = get_languages(reference_message.author)
+    return f"{reference_message.author.name} -- {reference_message.author.mention} -- {created_at} -- {languages} => {reference_message.content}"
 
 
 class StepsPaginator(pages.Paginator):
-    def __init__(self, introduction: str, steps: list[dict[str, Any]]) -> None:
+    def __init__(self, introduction: str, steps: list[dict[str, Any]], streaming: bool = False) -> None:
         self.introduction = introduction
         self.steps = steps
+        self.streaming = streaming
+        self.render_tasks: set[asyncio.Task] = set()
+        # Steps waiting for the batch window to close, while streaming.
+        self.pending_steps: list[int] = []
+        self.flush_handle: asyncio.TimerHandle | None = None
         super().__init__(
             pages=self.get_pages(),
             timeout=None,
         )
+
+    async def send(self, *args: Any, **kwargs: Any) -> discord.Message:
+        # The introduction goes out right away, and formula pages are swapped in once rendered.
+        self.queue_rendering(range(1, len(self.steps) + 1))
+        with metrics.span("send"):
+            return await super().send(*args, **kwargs)
+
+    async def edit(self, *args: Any, **kwargs: Any) -> discord.Message | None:
+        self.queue_rendering(range(1, len(self.steps) + 1))
+        with metrics.span("send"):
+            return await super().edit(*args, **kwargs)
+
+    async def add_step(self, step: dict[str, Any]) -> None:
+        self.steps.append(step)
+        self.pages.append(self.get_step_page(len(self.steps), step))
+        self.queue_rendering([len(self.steps)])
+        await self.update(pages=self.pages, current_page=self.current_page)
+
+    def queue_rendering(self, current_steps: Iterable[int]) -> None:
+        # A finished answer renders at once. A streaming one collects its steps, so they still
+        # share a latex pass instead of each formula getting its own.
+        if not self.streaming:
+            self.start_rendering(current_steps)
+            return
+        self.pending_steps.extend(current_steps)
+        if self.flush_handle is None:
+            self.flush_handle = asyncio.get_running_loop().call_later(RENDER_BATCH_WINDOW, self.flush_rendering)
+
+    def flush_rendering(self) -> None:
+        if self.flush_handle is not None:
+            self.flush_handle.cancel()
+            self.flush_handle = None
+        current_steps, self.pending_steps = self.pending_steps, []
+        self.start_rendering(current_steps)
+
+    def finish_streaming(self) -> None:
+        self.streaming = False
+        self.flush_rendering()
+
+    def start_rendering(self, current_steps: Iterable[int]) -> None:
+        formula_steps = [current_step for current_step in current_steps if self.steps[current_step - 1]["step_formula_text_or_code_type"] == "formula"]
+        if not formula_steps:
+            return
+        render_task = asyncio.create_task(self.render_formulas(formula_steps))
+        self.render_tasks.add(render_task)
+        render_task.add_done_callback(self.render_tasks.discard)
+
+    async def render_formulas(self, formula_steps: list[int]) -> None:
+        # Every formula in the batch is rendered by the same latex, dvisvgm and inkscape pass.
+        with metrics.span("latex"):
+            images = await latex2images([self.steps[current_step - 1]["step_formula_text_or_code"] for current_step in formula_steps])
+        for current_step, image in zip(formula_steps, images):
+            self.pages[current_step] = self.get_formula_page(current_step, self.steps[current_step - 1], image)
+        if self.message is not None and self.current_page in formula_steps:
+            await self.goto_page(self.current_page)
+
+    def get_formula_page(self, current_step: int, step: dict[str, Any], image: Path | None) -> pages.Page:
+        step_formula_or_code = step["step_formula_text_or_code"]
+        step_description = step["step_description"]
+        file_name = f"step{current_step}.png"
+        if image is None:
+            # The render failed or timed out, so the formula is shown as source instead.
+            return pages.Page(embeds=[discord.Embed(description=step_description).add_field(name="Fórmula", value=f"```latex\n{step_formula_or_code}\n```", inline=False)])
+        return pages.Page(
+            embeds=[discord.Embed(description=step_description).set_image(url=f"attachment://{file_name}")],
+            files=[discord.File(image, filename=file_name)],
+        )
     
+    def get_step_page(self, current_step: int, step: dict[str, Any]) -> pages.Page:
+        step_formula_or_code_type = step["step_formula_text_or_code_type"]
+        step_formula_or_code = step["step_formula_text_or_code"]
+        step_description = step["step_description"]
+        if step_formula_or_code_type == "text":
+            embeds = [discord.Embed(description=step_description).add_field(name="Texto", value=step_formula_or_code, inline=False)]
+        elif step_formula_or_code_type == "formula":
+            embeds = [discord.Embed(description=step_description).add_field(name="Fórmula", value="Renderizando... ⏳", inline=False)]
+        elif step_formula_or_code_type == "code":
+            embeds = [discord.Embed(description=step_description).add_field(name="Código", value=step_formula_or_code, inline=False)]
+        return pages.Page(embeds=embeds)
+
     def get_pages(self) -> list[pages.Page]:
-        pages_array = [pages.Page(content=self.introduction)]
-        for current_step, step in enumerate(self.steps, start=1):
-            step_formula_or_code_type = step["step_formula_text_or_code_type"]
-            step_formula_or_code = step["step_formula_text_or_code"]
-            step_description = step["step_description"]
-            file_name = f"step{current_step}.png"
-            if step_formula_or_code_type == "text":
-                embeds = [discord.Embed(description=step_description).add_field(name="Texto", value=step_formula_or_code, inline=False)]
-                files = None
-            elif step_formula_or_code_type == "formula":
-                latex2image(step_formula_or_code, file_name)
-                with open(file_name, "rb") as f:
-                    files = [discord.File(f, filename=file_name)]
-                embeds = [discord.Embed(description=step_description).set_image(url=f"attachment://{file_name}")]
-            elif step_formula_or_code_type == "code":
-                embeds = [discord.Embed(description=step_description).add_field(name="Código", value=step_formula_or_code, inline=False)]
-                files = None
-            pages_array.append(pages.Page(embeds=embeds, files=files))
-        return pages_array
+        return [pages.Page(content=self.introduction), *(self.get_step_page(current_step, step) for current_step, step in enumerate(self.steps, start=1))]
 
 
 class AI(commands.Cog):
     def __init__(self, bot: commands.Bot) -> None:
         self.bot = bot
+        self.generations: set[asyncio.Task] = set()
+        self.scheduler = TaskScheduler(self.send_task)
+        self.dispatcher = ChannelDispatcher(DISPATCH_CONCURRENCY)
+        # With worker processes, the histories, retrieval and generation run there and the
+        # gateway keeps this process to itself.
+        self.worker_pool = WorkerPool(WORKER_PROCESSES) if WORKER_PROCESSES > 0 else None
+        self.handler: type[HandleMessage] | RemoteHandleMessage = RemoteHandleMessage(self.worker_pool) if self.worker_pool is not None else HandleMessage
+
+    def cog_unload(self) -> None:
+        self.scheduler.stop()
+        self.dispatcher.stop()
+        if self.worker_pool is not None:
+            self.worker_pool.stop()
+        for generation in self.generations:
+            generation.cancel()
+        asyncio.create_task(close_session())
+
+    async def generate(self, message: discord.Message, coroutine: Coroutine[Any, Any, dict[str, Any]]) -> dict[str, Any] | None:
+        generation = asyncio.create_task(coroutine)
+        self.generations.add(generation)
+        generation.add_done_callback(self.generations.discard)
+        try:
+            return await generation
+        except asyncio.TimeoutError:
+            await message.reply("Me demoré demasiado en responder <:fmark:1196603895263268874>, inténtalo de nuevo.")
+            return None
+
+    async def respond(self, message: discord.Message, turn: dict[str, Any], debounce: float = 0.0, cache_key: str | None = None) -> None:
+        # Answers in a channel go one at a time, so they never interleave in its history. Work
+        # for the same message (a mention and its edits) replaces whatever is still pending.
+        await self.dispatcher.submit(message.channel.id, message.id, lambda: self.answer(message, turn, cache_key), debounce)
+
+    async def answer(self, message: discord.Message, turn: dict[str, Any], cache_key: str | None = None) -> None:
+        if cache_key is not None:
+            cached = await get_answer(cache_key)
+            if cached is not None:
+                self.handler.append_cached_response(message.channel.id, message.id, turn, cached)
+                await self.send_response(message, cached)
+                return
+        if STREAM_RESPONSES:
+            response = await self.generate(message, self.stream_response(message, self.handler.stream_response(message.channel.id, turn, message.id, message.content)))
+            if response is not None:
+                self.apply_tasks(message, response)
+        else:
+            response = await self.generate(message, self.handler.generate_response(message.channel.id, turn, message.id, message.content))
+            if response is not None:
+                self.apply_tasks(message, response)
+                await self.send_response(message, response)
+        if response is not None and cache_key is not None and is_cacheable(response):
+            await put_answer(cache_key, response)
+
+    def apply_tasks(self, message: discord.Message, response: dict[str, Any]) -> None:
+        tasks_to_add = [check_task_channel(message, task) for task in response["tasks_to_add"]]
+        tasks_to_edit = [check_task_channel(message, task) for task in response["tasks_to_edit"]]
+        tasks_to_remove = response["tasks_to_remove"]
+        apply_tasks(self.scheduler, tasks_to_add, tasks_to_edit, tasks_to_remove)
+
+    async def send_task(self, task_name: str, task: dict[str, Any], fire_time: float) -> None:
+        message_to_send = task["message_to_send"]
+        user_id = str(task["user_id"])
+        channel = self.bot.get_channel(task.get("channel_id") or DEFAULT_TASK_CHANNEL_ID)
+        if channel is None:
+            print(f"Channel for task {task_name} not found.")
+            return
+        # Only the member the task is for is pinged, whatever else the message mentions.
+        await channel.send(
+            message_to_send if user_id in message_to_send else f"<@{user_id}> {message_to_send}",
+            allowed_mentions=discord.AllowedMentions(everyone=False, roles=False, users=[discord.Object(int(user_id))]),
+        )
+        # Remembered so a fire missed during downtime can be told apart from one already sent.
+        if task_store.tasks.get(task_name) is task:
+            task_store.set_last_fired(task_name, fire_time)
+
+    async def stream_response(self, message: discord.Message, events: AsyncIterator[tuple[str, Any]]) -> dict[str, Any]:
+        introduction = ""
+        reply: discord.Message | None = None
+        paginator: StepsPaginator | None = None
+        async for event, value in events:
+            if event == "introduction":
+                introduction = value
+                if len(introduction) > 0:
+                    with metrics.span("send"):
+                        reply = await message.reply(introduction)
+            elif event == "step" and paginator is not None:
+                await paginator.add_step(value)
+            elif event == "step":
+                # The first step turns the plain reply into a paginator.
+                paginator = StepsPaginator(introduction, [value], streaming=True)
+                if reply is not None:
+                    await paginator.edit(reply)
+                else:
+                    ctx = await self.bot.get_context(message)
+                    await paginator.send(ctx, target=message.channel, reference=message)
+            elif event == "response":
+                if paginator is not None:
+                    paginator.finish_streaming()
+                return value
+        raise RuntimeError("The response stream ended without a response.")
+
+    async def send_response(self, message: discord.Message, response: dict[str, Any]) -> None:
+        steps = response.get("steps", [])
+        introduction = response["introduction"]
+        if len(steps) == 0:
+            if len(introduction) > 0:
+                with metrics.span("send"):
+                    await message.reply(introduction)
+            return
+        paginator = StepsPaginator(introduction, steps)
+        ctx = await self.bot.get_context(message)
+        await paginator.send(ctx, target=message.channel, reference=message)
 
     @commands.Cog.listener()
     async def on_message(self, message: discord.Message) -> None:
-        if self.bot.user.mentioned_in(message) and message.mention_everyone is False and message.author != self.bot.user:
-            reference = message.reference
-            if reference is not None:
-                reference_message = await message.channel.fetch_message(reference.message_id)
-                created_at = reference_message.created_at.strftime("%d/%m/%Y;%H:%M:%S")
-                language_roles = [role.name for role in reference_message.author.roles if role.name in ["Español", "English"]]
-                if len(language_roles) == 1:
-                    languages = language_roles[0]
-                elif len(language_roles) > 1:
-                    languages = "Español"
-                else:
-                    languages = "Lenguaje no especificado"
-                reference = f"{reference_message.author.name} -- {reference_message.author.mention} -- {created_at} -- {languages} => {reference_message.content}"
-            else:
-                reference = None
-            time = message.created_at.strftime("%d/%m/%Y;%H:%M:%S")
-            languages = [role.name for role in message.author.roles if role.name in ["Español", "English"]]
-            if len(languages) == 1:
-                languages = languages[0]
-            elif len(languages) > 1:
-                languages = "Español"
-            else:
-                languages = "Lenguaje no especificado"
-            response = HandleMessage.handle_message(
+        message_cache.add(message)
+        if message.author == self.bot.user:
+            return
+        reference = await format_reference(message)
+        time = message.created_at.strftime("%d/%m/%Y;%H:%M:%S")
+        languages = get_languages(message.author)
+        with metrics.span("attachments"):
+            files = await get_files_from_message(client, message)
+        if self.bot.user.mentioned_in(message) and message.mention_everyone is False:
+            # Replies depend on the message they answer, so only standalone questions are cached.
+            cache_key = get_answer_key(message.content, files, languages) if ANSWER_CACHE_ENABLED and reference is None else None
+            await self.respond(message, HandleMessage.build_message(
                 message.content, message.author.name, message.author.mention,
-                await get_files_from_message(client, message),
+                files,
                 reference,
                 time,
                 languages,
-            )
-            tasks_to_add = response["tasks_to_add"]
-            tasks_to_edit = response["tasks_to_edit"]
-            tasks_to_remove = response["tasks_to_remove"]
-            add_tasks(self.bot, tasks_to_add)
-            edit_tasks(self.bot, tasks_to_edit)
-            remove_tasks(self.bot, tasks_to_remove)
-            steps = response["steps"]
-            introduction = response["introduction"]
-            if len(steps) == 0 and len(introduction) > 0:
-                await message.reply(introduction)
-                return
-            paginator = StepsPaginator(introduction, steps)
-            ctx = await self.bot.get_context(message)
-            await paginator.send(ctx, target=message.channel, reference=message)
+            ), cache_key=cache_key)
             return
-        if message.author != self.bot.user:
-            reference = message.reference
-            if reference is not None:
-                reference_message = await message.channel.fetch_message(reference.message_id)
-                languages = [role.name for role in reference_message.author.roles if role.name in ["Español", "English"]]
-                if len(languages) == 1:
-                    languages = languages[0]
-                elif len(languages) > 1:
-                    languages = "Español"
-                else:
-                    languages = "Lenguaje no especificado"
-                created_at = reference_message.created_at.strftime("%d/%m/%Y;%H:%M:%S")
-                reference_mention = f"{reference_message.author.name} -- {reference_message.author.mention} -- {created_at} -- {languages} => {reference_message.content}"
-            else:
-                reference_mention = None
-            languages = [role.name for role in message.author.roles if role.name in ["Español", "English"]]
-            if len(languages) == 1:
-                languages = languages[0]
-            elif len(languages) > 1:
-                languages = "Español"
-            else:
-                languages = "Lenguaje no especificado"
-            time = message.created_at.strftime("%d/%m/%Y;%H:%M:%S")
-            HandleMessage.append_message_history(message.content, message.author.name, message.author.mention, await get_files_from_message(client, message), reference_mention, time, languages)
+        self.handler.append_message_history(message.channel.id, message.id, message.content, message.author.name, message.author.mention, files, reference, time, languages)
     
     @commands.Cog.listener()
     async def on_message_edit(self, before: discord.Message, after: discord.Message) -> None:
+        message_cache.add(after)
         if after.author == self.bot.user or before.author == self.bot.user:
             return
-        reference = after.reference
-        if reference is not None:
-            reference_message = await after.channel.fetch_message(reference.message_id)
-            created_at = reference_message.created_at.strftime("%d/%m/%Y;%H:%M:%S")
-            language_roles = [role.name for role in reference_message.author.roles if role.name in ["Español", "English"]]
-            if len(language_roles) == 1:
-                languages = language_roles[0]
-            elif len(language_roles) > 1:
-                languages = "Español"
-            else:
-                languages = "Lenguaje no especificado"
-            reference = f"{reference_message.author.name} -- {reference_message.author.mention} -- {created_at} -- {languages} => {reference_message.content}"
-        else:
-            reference = None
+        # Discord also sends edits when a link preview loads, which change nothing we read.
+        if before.content == after.content and [attachment.id for attachment in before.attachments] == [attachment.id for attachment in after.attachments]:
+            return
+        reference = await format_reference(after)
+        time = after.created_at.strftime("%d/%m/%Y;%H:%M:%S")
+        languages = get_languages(after.author)
+        with metrics.span("attachments"):
+            files = await get_files_from_message(client, after)
         if self.bot.user.mentioned_in(after) and after.mention_everyone is False:
-            time = after.created_at.strftime("%d/%m/%Y;%H:%M:%S")
-            languages = [role.name for role in after.author.roles if role.name in ["Español", "English"]]
-            if len(languages) == 1:
-                languages = languages[0]
-            elif len(languages) > 1:
-                languages = "Español"
-            else:
-                languages = "Lenguaje no especificado"
-            response = HandleMessage.handle_edit_message(
+            await self.respond(after, HandleMessage.build_edit_message(
                 before.content, after.content,
                 after.author.name, after.author.mention,
-                await get_files_from_message(client, after),
+                files,
                 reference,
                 time,
                 languages,
-            )
-            tasks_to_add = response["tasks_to_add"]
-            tasks_to_edit = response["tasks_to_edit"]
-            tasks_to_remove = response["tasks_to_remove"]
-            add_tasks(self.bot, tasks_to_add)
-            edit_tasks(self.bot, tasks_to_edit)
-            remove_tasks(self.bot, tasks_to_remove)
-            introduction = response["introduction"]
-            steps = response.get("steps", [])
-            if len(steps) == 0:
-                await after.reply(introduction)
-                return
-            paginator = StepsPaginator(introduction, steps)
-            ctx = await self.bot.get_context(after)
-            await paginator.send(ctx, target=after.channel, reference=after)
+            ), EDIT_DEBOUNCE)
             return
-        time = after.created_at.strftime("%d/%m/%Y;%H:%M:%S")
-        languages = [role.name for role in after.author.roles if role.name in ["Español", "English"]]
-        if len(languages) == 1:
-            languages = languages[0]
-        elif len(languages) > 1:
-            languages = "Español"
-        else:
-            languages = "Lenguaje no especificado"
-        HandleMessage.append_message_history_edit(before.content, after.content, after.author.name, after.author.mention, await get_files_from_message(client, after), reference, time, languages)
+        self.handler.append_message_history_edit(after.channel.id, after.id, before.content, after.content, after.author.name, after.author.mention, files, reference, time, languages)
     
     @commands.Cog.listener()
     async def on_message_delete(self, message: discord.Message) -> None:
-        if message.author != self.bot.user and self.bot.user.mentioned_in(message) and message.mention_everyone is False:
-            reference = message.reference
-            if reference is not None:
-                reference_message = await message.channel.fetch_message(reference.message_id)
-                created_at = reference_message.created_at.strftime("%d/%m/%Y;%H:%M:%S")
-                language_roles = [role.name for role in reference_message.author.roles if role.name in ["Español", "English"]]
-                if len(language_roles) == 1:
-                    languages = languages[0]
-                elif len(language_roles) > 1:
-                    languages = "Español"
-                else:
-                    languages = "Lenguaje no especificado"
-                reference_mention = f"{reference_message.author.name} -- {reference_message.author.mention} -- {created_at} -- {languages} => {reference_message.content}"
-            else:
-                reference_mention = None
-            languages = [role.name for role in message.author.roles if role.name in ["Español", "English"]]
-            if len(languages) == 1:
-                languages = languages[0]
-            elif len(languages) > 1:
-                languages = "Español"
-            else:
-                languages = "Lenguaje no especificado"
-            time = message.created_at.strftime("%d/%m/%Y;%H:%M:%S")
-            response = HandleMessage.handle_delete_message(message.content, message.author.name, message.author.mention, await get_files_from_message(client, message), reference_mention, time, languages)
-            tasks_to_add = response["tasks_to_add"]
-            tasks_to_edit = response["tasks_to_edit"]
-            tasks_to_remove = response["tasks_to_remove"]
-            add_tasks(self.bot, tasks_to_add)
-            edit_tasks(self.bot, tasks_to_edit)
-            remove_tasks(self.bot, tasks_to_remove)
-            introduction = response["introduction"]
-            steps = response["steps"]
-            if len(steps) == 0:
-                await message.reply(introduction)
-                return
-            paginator = StepsPaginator(introduction, steps)
-            ctx = await self.bot.get_context(message)
-            await paginator.send(ctx, target=message.channel, reference=message)
+        message_cache.invalidate(message.id)
+        if message.author == self.bot.user:
             return
-        elif message.author != self.bot.user:
-            reference = message.reference
-            if reference is not None:
-                reference_message = await message.channel.fetch_message(reference.message_id)
-                languages = [role.name for role in reference_message.author.roles if role.name in ["Español", "English"]]
-                if len(languages) == 1:
-                    languages = languages[0]
-                elif len(languages) > 1:
-                    languages = "Español"
-                else:
-                    languages = "Lenguaje no especificado"
-                created_at = reference_message.created_at.strftime("%d/%m/%Y;%H:%M:%S")
-                reference_mention = f"{reference_message.author.name} -- {reference_message.author.mention} -- {created_at} -- {languages} => {reference_message.content}"
-            else:
-                reference_mention = None
-            languages = [role.name for role in message.author.roles if role.name in ["Español", "English"]]
-            if len(languages) == 1:
-                languages = languages[0]
-            elif len(languages) > 1:
-                languages = "Español"
-            else:
-                languages = "Lenguaje no especificado"
-            time = message.created_at.strftime("%d/%m/%Y;%H:%M:%S")
-            HandleMessage.append_message_history_delete(message.content, message.author.name, message.author.mention, await get_files_from_message(client, message), reference_mention, time, languages)
+        reference = await format_reference(message)
+        time = message.created_at.strftime("%d/%m/%Y;%H:%M:%S")
+        languages = get_languages(message.author)
+        if self.bot.user.mentioned_in(message) and message.mention_everyone is False:
+            with metrics.span("attachments"):
+                files = await get_files_from_message(client, message)
+            await self.respond(message, HandleMessage.build_delete_message(message.content, message.author.name, message.author.mention, files, reference, time, languages))
+            return
+        self.handler.append_message_history_delete(message.channel.id, message.id, message.content, message.author.name, message.author.mention, reference, time, languages)
 
     @commands.Cog.listener()
     async def on_ready(self) -> None:
         await self.bot.change_presence(activity=discord.Game(name="Demostrar hipótesis de Riemann."))
-        print(tasks)
-        init_tasks(self.bot, tasks)
+        print(task_store.tasks)
+        init_tasks(self.scheduler, task_store.tasks)
+        self.scheduler.start()
         print(f"Logged in as {self.bot.user}.")
 
 
 def setup(bot: commands.Bot) -> None:
-    bot.add_cog(AI(bot))
\ No newline at end of file
+    bot.add_cog(AI(bot))
@@ -1,19 +1,40 @@
-import json
-from pathlib import Path
+from collections.abc import Sequence
 
 import discord
 
-from discord.ext import commands
+from discord.ext import commands, pages
 
+from the_math_guys_bot.utils.points_store import points_store
 
-thankfulness_points_file = Path("thankfulness_points.json")
 
-if not thankfulness_points_file.exists():
-    with open(thankfulness_points_file, "w") as f:
-        json.dump({}, f)
+LEADERBOARD_PAGE_SIZE: int = 20
 
-with open(thankfulness_points_file, "r") as f:
-    thankfulness_points = json.load(f)
+
+class LeaderboardPages(Sequence):
+    # Pages are read from the database when the paginator first shows them. Each one starts
+    # after the last helper of the page before, so no query skips over the helpers above it.
+    def __init__(self) -> None:
+        self.length = -(-points_store.count() // LEADERBOARD_PAGE_SIZE)
+        self.loaded: list[pages.Page] = []
+        self.last_row: tuple[int, int] | None = None
+
+    def __len__(self) -> int:
+        return self.length
+
+    def __getitem__(self, index: int) -> pages.Page:
+        if not -self.length <= index < self.length:
+            raise IndexError(index)
+        index %= self.length
+        while len(self.loaded) <= index:
+            offset = len(self.loaded) * LEADERBOARD_PAGE_SIZE
+            rows = points_store.page(self.last_row, LEADERBOARD_PAGE_SIZE)
+            if not rows:
+                # Helpers left the server after the pages were counted.
+                self.loaded.append(pages.Page(content="No hay más ayudantes."))
+                continue
+            self.last_row = rows[-1]
+            self.loaded.append(pages.Page(content="\n".join(f"{offset + i + 1}. <@{member_id}>: {points}" for i, (member_id, points) in enumerate(rows))))
+        return self.loaded[index]
 
 
 class Helpers(commands.Cog):
@@ -28,11 +49,7 @@ class Helpers(commands.Cog):
         if not any(role.name.startswith("Ayudante") for role in member.roles):
             await ctx.send("Solo puedes agradecer a ayudantes.")
             return
-        if str(member.id) not in thankfulness_points:
-            thankfulness_points[str(member.id)] = 0
-        thankfulness_points[str(member.id)] += 1
-        with open(thankfulness_points_file, "w") as f:
-            json.dump(thankfulness_points, f)
+        points_store.add(member.id, 1)
         await ctx.send(f"{ctx.author.mention} thanked {member.mention}.")
     
     @commands.slash_command(name="sancionar", description="Sanciona a un ayudante.")
@@ -46,34 +63,30 @@ class Helpers(commands.Cog):
         if not any(role.name.startswith("Ayudante") for role in member.roles):
             await ctx.send("Solo puedes sancionar a ayudantes.")
             return
-        if str(member.id) not in thankfulness_points:
-            thankfulness_points[str(member.id)] = 0
-        if thankfulness_points[str(member.id)] > 0:
-            thankfulness_points[str(member.id)] -= 1
-        with open(thankfulness_points_file, "w") as f:
-            json.dump(thankfulness_points, f)
+        points_store.add(member.id, -1)
         await ctx.send(f"{ctx.author.mention} punished {member.mention}.")
 
     @commands.slash_command(name="puntos", description="Muestra los puntos de agradecimiento de un ayudante.")
     async def points(self, ctx, member: discord.Member) -> None:
-        if str(member.id) not in thankfulness_points:
+        points = points_store.get(member.id)
+        if points is None:
             await ctx.send(f"{member.mention} no tiene puntos de agradecimiento.")
             return
-        await ctx.send(f"{member.mention} tiene {thankfulness_points[str(member.id)]} puntos de agradecimiento.")
+        await ctx.send(f"{member.mention} tiene {points} puntos de agradecimiento (puesto {points_store.rank(member.id)}).")
     
     @commands.slash_command(name="puntos-todos", description="Muestra los puntos de agradecimiento de todos los ayudantes.")
     async def all_points(self, ctx) -> None:
-        if not thankfulness_points:
+        leaderboard_pages = LeaderboardPages()
+        if not leaderboard_pages:
             await ctx.send("Aún ningún ayudante ha recibido agradecimientos.")
             return
-        await ctx.send("\n".join(f"{i + 1}. <@{member_id}>: {points}" for i, (member_id, points) in enumerate(sorted(thankfulness_points.items(), key=lambda x: x[1], reverse=True))))
+        # One page per LEADERBOARD_PAGE_SIZE helpers, so the message never exceeds Discord's limit.
+        paginator = pages.Paginator(pages=leaderboard_pages, timeout=None)
+        await paginator.respond(ctx.interaction)
 
     @commands.Cog.listener()
     async def on_member_remove(self, member: discord.Member) -> None:
-        if str(member.id) in thankfulness_points:
-            del thankfulness_points[str(member.id)]
-            with open(thankfulness_points_file, "w") as f:
-                json.dump(thankfulness_points, f)
+        points_store.remove(member.id)
 
 
 def setup(bot: commands.Bot) -> None:
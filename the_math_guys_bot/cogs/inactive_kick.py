@@ -1,12 +1,18 @@
+import asyncio
 import datetime
 import json
 from pathlib import Path
 import random
+from typing import Awaitable, Callable
 
 import discord
 
 from discord.ext import commands, tasks
 
+from the_math_guys_bot.utils.action_queue import ACTIONS_DB_PATH, Action, ActionQueue, pack_mentions
+from the_math_guys_bot.utils.activity_index import activity_index
+from the_math_guys_bot.utils.backfill import Backfill
+
 
 ACTIVE_MEMBER_ROLE: int = 1327719103636574209
 ACTIVITY_THRESHOLD: int = 10
@@ -15,47 +21,63 @@ ACTIVITY_THRESHOLD: int = 10
 class InactiveKick(commands.Cog):
     def __init__(self, bot: commands.Bot) -> None:
         self.bot = bot
+        self.action_queue = ActionQueue(bot, ACTIONS_DB_PATH)
+        self.resuming: asyncio.Task | None = None
     
-    async def fetch_inactive_users(self, days: int) -> None:
-        active_users = []
-        real_active_users = []
+    async def backfill(self, guild: discord.Guild, since: datetime.datetime, progress: Callable[[int, int, int], Awaitable[None]] | None = None) -> None:
+        # Only the period before the index started listening has to be read from the history.
+        complete_since = activity_index.get_complete_since(guild.id)
+        if since.timestamp() >= complete_since:
+            return
+        print("Backfilling activity index...")
+        await Backfill(guild, since.timestamp(), complete_since, progress).run()
+        activity_index.set_complete_since(guild.id, since.timestamp())
+
+    async def fetch_inactive_users(self, days: int, progress: Callable[[int, int, int], Awaitable[None]] | None = None) -> None:
         guild: discord.Guild = self.bot.get_guild(1045453708642758657)
-        roles = guild.roles
-        role = discord.utils.get(roles, id=ACTIVE_MEMBER_ROLE)
-        for channel in guild.text_channels:
-            async for message in channel.history(limit=None, after=datetime.datetime.now() - datetime.timedelta(days=days)):
-                if message.author not in active_users:
-                    active_users.append(message.author)
-                if message.created_at > discord.utils.utcnow() - datetime.timedelta(days=ACTIVITY_THRESHOLD):
-                    if message.author not in real_active_users:
-                        real_active_users.append(message.author)
+        now = discord.utils.utcnow()
+        await self.backfill(guild, now - datetime.timedelta(days=max(days, ACTIVITY_THRESHOLD)), progress)
+        last_seen = activity_index.get_last_seen(guild.id)
+        active_since = (now - datetime.timedelta(days=days)).timestamp()
+        real_active_since = (now - datetime.timedelta(days=ACTIVITY_THRESHOLD)).timestamp()
         inactive_json = {}
         inactive_json_path = Path("inactive_users.json")
         print("Processing inactive users...")
+        # The role changes are worked out up front and applied as one batch.
+        role_actions = []
         for member in guild.members:
             member: discord.Member
-            if member not in active_users:
+            last_message_at = last_seen.get(member.id, 0)
+            if last_message_at < active_since:
                 inactive_json[member.id] = {
                     "name": member.name,
                     "discriminator": member.discriminator,
                     "joined_at": member.joined_at.isoformat(),
                     "created_at": member.created_at.isoformat(),
                 }
-            if member in real_active_users and ACTIVE_MEMBER_ROLE not in [role.id for role in member.roles]:
-                await member.add_roles(role)
-            if member not in real_active_users and ACTIVE_MEMBER_ROLE in [role.id for role in member.roles]:
-                await member.remove_roles(role)
+            has_role = member.get_role(ACTIVE_MEMBER_ROLE) is not None
+            if last_message_at >= real_active_since and not has_role:
+                role_actions.append(Action("add_role", guild.id, member.id, str(ACTIVE_MEMBER_ROLE)))
+            if last_message_at < real_active_since and has_role:
+                role_actions.append(Action("remove_role", guild.id, member.id, str(ACTIVE_MEMBER_ROLE)))
         with open(inactive_json_path, "w") as f:
             json.dump(inactive_json, f)
+        self.action_queue.enqueue("active-role", role_actions)
+        await self.action_queue.run("active-role")
 
     @commands.slash_command(name="fetch-inactive", description="Fetch inactive users")
     async def fetch_inactive_and_active(self, ctx, days: int) -> None:
         if ctx.author.id != 546393436668952663:
             await ctx.send("You don't have permission to use this command.")
             return
-        await ctx.interaction.response.defer()
-        await self.fetch_inactive_users(days)
-        await ctx.interaction.followup.send("Inactive users have been fetched.")
+        # Backfills can take hours and the interaction token expires after 15 minutes, so progress
+        # goes to a regular channel message.
+        await ctx.respond("Fetching inactive users...")
+        progress_message = await ctx.channel.send("Backfilling message history...")
+        async def report_progress(channels_done: int, channels: int, messages: int) -> None:
+            await progress_message.edit(content=f"Backfilling message history: {channels_done}/{channels} channels, {messages} messages read...")
+        await self.fetch_inactive_users(days, report_progress)
+        await progress_message.edit(content="Inactive users have been fetched.")
     
     @commands.slash_command(name="mention-inactive", description="Mention inactive users")
     async def mention_inactive(self, ctx) -> None:
@@ -65,23 +87,17 @@ class InactiveKick(commands.Cog):
         await ctx.interaction.response.defer()
         inactive_json_path = Path("inactive_users.json")
         if not inactive_json_path.exists():
-            await ctx.send("You didn't fetch inactive users yet.")
+            await ctx.interaction.followup.send("You didn't fetch inactive users yet.")
+            return
         with open(inactive_json_path, "r") as f:
             inactive_json = json.load(f)
         inactive_users = []
         for member_id, member_data in inactive_json.items():
-            member: discord.Member = ctx.guild.get_member(int(member_id))
-            inactive_users.append(member.mention)
-        message = " ".join(inactive_users)
-        for i in range(0, len(message), 2000):
-            message_to_send = message[i:i+2000]
-            first_mention_index = message_to_send.find("<@")
-            if first_mention_index != -1:
-                message_to_send = message_to_send[first_mention_index:]
-            last_mention_index = message_to_send.rfind("<@")
-            if last_mention_index != -1:
-                message_to_send = message_to_send[:last_mention_index]
-            await ctx.send(message_to_send)
+            member: discord.Member | None = ctx.guild.get_member(int(member_id))
+            if member is not None:
+                inactive_users.append(member.mention)
+        self.action_queue.enqueue("mention-inactive", [Action("send", ctx.channel.id, 0, message) for message in pack_mentions(inactive_users)])
+        await self.action_queue.run("mention-inactive")
         await ctx.interaction.followup.send("Inactive users have been mentioned.")
     
     @commands.slash_command(name="kick-inactive", description="Kick inactive users")
@@ -92,26 +108,46 @@ class InactiveKick(commands.Cog):
         await ctx.interaction.response.defer()
         inactive_json_path = Path("inactive_users.json")
         if not inactive_json_path.exists():
-            await ctx.send("You didn't fetch inactive users yet.")
+            await ctx.interaction.followup.send("You didn't fetch inactive users yet.")
+            return
         with open(inactive_json_path, "r") as f:
             inactive_json = json.load(f)
         guild: discord.Guild = ctx.guild
-        while number > 0:
-            member_id = random.choice(list(inactive_json.keys()))
-            member: discord.Member = guild.get_member(int(member_id))
-            await member.kick(reason="Inactive user")
-            del inactive_json[member_id]
-            number -= 1
-        await ctx.interaction.followup.send(f"{number} inactive users have been kicked.")
+        member_ids = random.sample(list(inactive_json), min(number, len(inactive_json)))
+        self.action_queue.enqueue("kick-inactive", [Action("kick", guild.id, int(member_id), "Inactive user") for member_id in member_ids])
+        kicked = await self.action_queue.run("kick-inactive")
+        await ctx.interaction.followup.send(f"{kicked} inactive users have been kicked.")
         inactive_json_path.unlink()
     
     @tasks.loop(hours=24)
     async def check_active_members(self) -> None:
         await self.fetch_inactive_users(30)
     
+    @tasks.loop(minutes=1)
+    async def flush_activity(self) -> None:
+        activity_index.flush()
+
+    def cog_unload(self) -> None:
+        self.flush_activity.cancel()
+        activity_index.flush()
+
+    @commands.Cog.listener()
+    async def on_message(self, message: discord.Message) -> None:
+        if message.guild is not None:
+            activity_index.record(message.guild.id, message.author.id, message.created_at.timestamp())
+
     @commands.Cog.listener()
     async def on_ready(self) -> None:
-        self.check_active_members.start()
+        # The index is complete from the moment the bot first listens to a guild.
+        for guild in self.bot.guilds:
+            activity_index.get_complete_since(guild.id)
+        if not self.flush_activity.is_running():
+            self.flush_activity.start()
+        # Batches cut short by a restart pick up where they stopped.
+        if self.resuming is None:
+            self.resuming = asyncio.create_task(self.action_queue.resume())
+        if not self.check_active_members.is_running():
+            self.check_active_members.start()
 
 
 def setup(bot: commands.Bot) -> None:
@@ -0,0 +1,70 @@
+import asyncio
+import os
+from pathlib import Path
+
+from aiohttp import web
+from discord.ext import commands, tasks
+
+from the_math_guys_bot.utils.metrics import metrics
+
+
+# Both exports are off unless configured. The endpoint only listens on localhost.
+METRICS_FILE: str | None = os.getenv("METRICS_FILE")
+METRICS_PORT: int | None = int(os.getenv("METRICS_PORT")) if os.getenv("METRICS_PORT") else None
+METRICS_EXPORT_INTERVAL: float = float(os.getenv("METRICS_EXPORT_INTERVAL", "15"))
+STAGES: list[str] = ["queue_wait", "attachments", "reference", "classify", "search", "fetch_pages", "youtube", "generate", "latex", "send"]
+
+
+def write_metrics(path: Path, text: str) -> None:
+    # Written next to the target and renamed, so a scraper never reads half a file.
+    temp_path = path.with_suffix(f"{path.suffix}.tmp")
+    temp_path.write_text(text, encoding="utf-8")
+    os.replace(temp_path, path)
+
+
+async def serve_metrics(request: web.Request) -> web.Response:
+    return web.Response(text=metrics.render_prometheus(), content_type="text/plain", charset="utf-8")
+
+
+class Metrics(commands.Cog):
+    def __init__(self, bot: commands.Bot) -> None:
+        self.bot = bot
+        self.runner: web.AppRunner | None = None
+
+    @tasks.loop(seconds=METRICS_EXPORT_INTERVAL)
+    async def export_metrics(self) -> None:
+        await asyncio.to_thread(write_metrics, Path(METRICS_FILE), metrics.render_prometheus())
+
+    async def start_server(self) -> None:
+        app = web.Application()
+        app.router.add_get("/metrics", serve_metrics)
+        self.runner = web.AppRunner(app)
+        await self.runner.setup()
+        await web.TCPSite(self.runner, "127.0.0.1", METRICS_PORT).start()
+
+    def cog_unload(self) -> None:
+        self.export_metrics.cancel()
+        if self.runner is not None:
+            asyncio.create_task(self.runner.cleanup())
+
+    @commands.slash_command(name="metrics", description="Show the latency of each stage")
+    async def show_metrics(self, ctx) -> None:
+        if ctx.author.id != 546393436668952663:
+            await ctx.respond("You don't have permission to use this command.", ephemeral=True)
+            return
+        lines = [f"{'stage':<12}{'count':>7}{'p50 ms':>10}{'p95 ms':>10}"]
+        for stage in STAGES:
+            count, p50, p95 = metrics.get_summary(stage)
+            lines.append(f"{stage:<12}{count:>7}{p50 * 1000:>10.1f}{p95 * 1000:>10.1f}")
+        await ctx.respond("```\n" + "\n".join(lines) + "\n```", ephemeral=True)
+
+    @commands.Cog.listener()
+    async def on_ready(self) -> None:
+        if METRICS_FILE is not None and not self.export_metrics.is_running():
+            self.export_metrics.start()
+        if METRICS_PORT is not None and self.runner is None:
+            await self.start_server()
+
+
+def setup(bot: commands.Bot) -> None:
+    bot.add_cog(Metrics(bot))
@@ -0,0 +1,159 @@
+import asyncio
+import os
+import sqlite3
+import threading
+from collections import defaultdict, deque
+from pathlib import Path
+from typing import NamedTuple
+
+import discord
+from discord.ext import commands
+
+from the_math_guys_bot.utils.rate_limit import RequestBudget
+
+
+ACTIONS_DB_PATH: Path = Path(os.getenv("ACTIONS_DB_PATH", "actions.db"))
+BULK_ACTION_CONCURRENCY: int = int(os.getenv("BULK_ACTION_CONCURRENCY", "2"))
+# Per rate-limit bucket. Role edits and kicks share tight per-guild buckets on Discord's side.
+BULK_ACTIONS_PER_SECOND: float = float(os.getenv("BULK_ACTIONS_PER_SECOND", "2"))
+MESSAGE_LENGTH_LIMIT: int = 2000
+
+
+class Action(NamedTuple):
+    # kind is "add_role", "remove_role", "kick" or "send". For guild actions, scope_id is the guild
+    # and target_id the member; for "send", scope_id is the channel. argument is the role ID,
+    # the kick reason or the message content.
+    kind: str
+    scope_id: int
+    target_id: int
+    argument: str
+
+
+def get_bucket(action: Action) -> tuple[str, int]:
+    # Messages to a channel are sent one at a time, in order.
+    if action.kind in ("add_role", "remove_role"):
+        return "roles", action.scope_id
+    return action.kind, action.scope_id
+
+
+def pack_mentions(mentions: list[str], limit: int = MESSAGE_LENGTH_LIMIT) -> list[str]:
+    # Fills each message with as many whole mentions as fit.
+    messages = []
+    current = ""
+    for mention in mentions:
+        if current and len(current) + 1 + len(mention) > limit:
+            messages.append(current)
+            current = ""
+        current = f"{current} {mention}" if current else mention
+    if current:
+        messages.append(current)
+    return messages
+
+
+class ActionQueue:
+    # Bulk guild changes, persisted in SQLite before they run, so a restart resumes the batch.
+    # Actions run with bounded concurrency and a request budget per rate-limit bucket.
+    def __init__(self, bot: commands.Bot, path: Path) -> None:
+        self.bot = bot
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.lock = threading.Lock()
+        # Batch name -> (task, how many of its actions have succeeded so far).
+        self.running: dict[str, tuple[asyncio.Task, list[int]]] = {}
+        with self.lock, self.connection:
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            self.connection.execute("CREATE TABLE IF NOT EXISTS actions (batch TEXT NOT NULL, position INTEGER NOT NULL, kind TEXT NOT NULL, scope_id INTEGER NOT NULL, target_id INTEGER NOT NULL, argument TEXT NOT NULL, PRIMARY KEY (batch, position))")
+
+    def enqueue(self, batch: str, actions: list[Action]) -> None:
+        # A new batch replaces whatever was left of the previous one with the same name. Its
+        # positions continue after the old ones, so an old action still being marked done
+        # cannot delete a new one.
+        if batch in self.running:
+            self.running.pop(batch)[0].cancel()
+        with self.lock, self.connection:
+            start = self.connection.execute("SELECT coalesce(max(position) + 1, 0) FROM actions WHERE batch = ?", (batch,)).fetchone()[0]
+            self.connection.execute("DELETE FROM actions WHERE batch = ?", (batch,))
+            self.connection.executemany(
+                "INSERT INTO actions (batch, position, kind, scope_id, target_id, argument) VALUES (?, ?, ?, ?, ?, ?)",
+                ((batch, start + position, *action) for position, action in enumerate(actions)),
+            )
+
+    def get_pending(self, batch: str) -> list[tuple[int, Action]]:
+        with self.lock:
+            rows = self.connection.execute("SELECT position, kind, scope_id, target_id, argument FROM actions WHERE batch = ? ORDER BY position", (batch,)).fetchall()
+        return [(position, Action(*action)) for position, *action in rows]
+
+    def mark_done(self, batch: str, position: int) -> None:
+        with self.lock, self.connection:
+            self.connection.execute("DELETE FROM actions WHERE batch = ? AND position = ?", (batch, position))
+
+    async def run(self, batch: str) -> int:
+        # Returns how many actions succeeded. When a newer batch with the same name replaces
+        # this one, it returns how many had succeeded by then, and the new batch runs the rest.
+        if batch not in self.running:
+            succeeded = [0]
+            self.running[batch] = (asyncio.create_task(self.run_batch(batch, succeeded)), succeeded)
+        task, succeeded = self.running[batch]
+        try:
+            return await asyncio.shield(task)
+        except asyncio.CancelledError:
+            if task.cancelled() and self.running.get(batch, (None,))[0] is not task:
+                return succeeded[0]
+            raise
+        finally:
+            if task.done() and self.running.get(batch, (None,))[0] is task:
+                self.running.pop(batch)
+
+    async def resume(self) -> None:
+        with self.lock:
+            batches = [batch for batch, in self.connection.execute("SELECT DISTINCT batch FROM actions")]
+        await asyncio.gather(*(self.run(batch) for batch in batches))
+
+    async def run_batch(self, batch: str, succeeded: list[int]) -> int:
+        buckets: defaultdict[tuple[str, int], deque[tuple[int, Action]]] = defaultdict(deque)
+        for position, action in self.get_pending(batch):
+            buckets[get_bucket(action)].append((position, action))
+        workers = []
+        for bucket, actions in buckets.items():
+            budget = RequestBudget(BULK_ACTIONS_PER_SECOND)
+            concurrency = 1 if bucket[0] == "send" else BULK_ACTION_CONCURRENCY
+            workers.extend(self.work(batch, actions, budget, succeeded) for _ in range(concurrency))
+        await asyncio.gather(*workers)
+        return succeeded[0]
+
+    async def work(self, batch: str, actions: deque[tuple[int, Action]], budget: RequestBudget, succeeded: list[int]) -> None:
+        while actions:
+            position, action = actions.popleft()
+            await budget.wait()
+            try:
+                if await self.execute(action):
+                    succeeded[0] += 1
+            except discord.NotFound:
+                pass
+            except discord.HTTPException as e:
+                print(f"Action {action} failed: {e!r}")
+            # Failures are not retried; the library already retries rate-limited requests.
+            await asyncio.to_thread(self.mark_done, batch, position)
+
+    async def execute(self, action: Action) -> bool:
+        # Returns False when the channel, member or role no longer exists.
+        if action.kind == "send":
+            channel = self.bot.get_channel(action.scope_id)
+            if channel is None:
+                return False
+            await channel.send(action.argument)
+            return True
+        guild = self.bot.get_guild(action.scope_id)
+        member = guild.get_member(action.target_id) if guild is not None else None
+        if member is None:
+            return False
+        if action.kind == "kick":
+            await member.kick(reason=action.argument)
+            return True
+        role = guild.get_role(int(action.argument))
+        if role is None:
+            return False
+        if action.kind == "add_role":
+            await member.add_roles(role)
+        else:
+            await member.remove_roles(role)
+        return True
@@ -0,0 +1,76 @@
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+
+ACTIVITY_DB_PATH: Path = Path(os.getenv("ACTIVITY_DB_PATH", "activity.db"))
+
+
+class ActivityIndex:
+    # Last message time of every member, per guild, fed by the messages the bot receives.
+    # Each guild also stores the time since which the index is complete; anything older has to
+    # be backfilled from the channel history once.
+    def __init__(self, path: Path) -> None:
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.lock = threading.Lock()
+        # (guild ID, member ID) -> last message time, not yet written to disk.
+        self.pending: dict[tuple[int, int], float] = {}
+        with self.lock, self.connection:
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            self.connection.execute("PRAGMA synchronous=NORMAL")
+            self.connection.execute("CREATE TABLE IF NOT EXISTS last_seen (guild_id INTEGER NOT NULL, member_id INTEGER NOT NULL, last_message_at REAL NOT NULL, PRIMARY KEY (guild_id, member_id))")
+            self.connection.execute("CREATE TABLE IF NOT EXISTS coverage (guild_id INTEGER PRIMARY KEY, complete_since REAL NOT NULL)")
+            # Oldest message time each channel has been backfilled down to.
+            self.connection.execute("CREATE TABLE IF NOT EXISTS backfill_checkpoints (guild_id INTEGER NOT NULL, channel_id INTEGER NOT NULL, cursor REAL NOT NULL, PRIMARY KEY (guild_id, channel_id))")
+
+    def record(self, guild_id: int, member_id: int, timestamp: float) -> None:
+        key = (guild_id, member_id)
+        if self.pending.get(key, 0) < timestamp:
+            self.pending[key] = timestamp
+
+    def flush(self) -> None:
+        if not self.pending:
+            return
+        pending, self.pending = self.pending, {}
+        with self.lock, self.connection:
+            self.connection.executemany(
+                "INSERT INTO last_seen (guild_id, member_id, last_message_at) VALUES (?, ?, ?) "
+                "ON CONFLICT (guild_id, member_id) DO UPDATE SET last_message_at = max(last_message_at, excluded.last_message_at)",
+                ((guild_id, member_id, timestamp) for (guild_id, member_id), timestamp in pending.items()),
+            )
+
+    def get_last_seen(self, guild_id: int) -> dict[int, float]:
+        self.flush()
+        with self.lock:
+            return dict(self.connection.execute("SELECT member_id, last_message_at FROM last_seen WHERE guild_id = ?", (guild_id,)))
+
+    def get_complete_since(self, guild_id: int) -> float:
+        # A guild seen for the first time is complete from now on.
+        with self.lock, self.connection:
+            self.connection.execute("INSERT OR IGNORE INTO coverage (guild_id, complete_since) VALUES (?, ?)", (guild_id, time.time()))
+            return self.connection.execute("SELECT complete_since FROM coverage WHERE guild_id = ?", (guild_id,)).fetchone()[0]
+
+    def set_complete_since(self, guild_id: int, timestamp: float) -> None:
+        self.flush()
+        with self.lock, self.connection:
+            self.connection.execute(
+                "INSERT INTO coverage (guild_id, complete_since) VALUES (?, ?) ON CONFLICT (guild_id) DO UPDATE SET complete_since = min(complete_since, excluded.complete_since)",
+                (guild_id, timestamp),
+            )
+            # The backfill always runs down from complete_since, so moving it invalidates the checkpoints.
+            self.connection.execute("DELETE FROM backfill_checkpoints WHERE guild_id = ?", (guild_id,))
+
+    def get_checkpoints(self, guild_id: int) -> dict[int, float]:
+        with self.lock:
+            return dict(self.connection.execute("SELECT channel_id, cursor FROM backfill_checkpoints WHERE guild_id = ?", (guild_id,)))
+
+    def set_checkpoint(self, guild_id: int, channel_id: int, cursor: float) -> None:
+        # The messages before the cursor are written first, so a checkpoint never gets ahead of the data.
+        self.flush()
+        with self.lock, self.connection:
+            self.connection.execute("INSERT OR REPLACE INTO backfill_checkpoints (guild_id, channel_id, cursor) VALUES (?, ?, ?)", (guild_id, channel_id, cursor))
+
+
+activity_index = ActivityIndex(ACTIVITY_DB_PATH)
@@ -0,0 +1,86 @@
+import asyncio
+import hashlib
+import os
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Awaitable, Callable, NamedTuple
+
+import aiohttp
+import discord
+from google.genai import types
+
+from the_math_guys_bot.utils.disk_cache import DiskCache
+from the_math_guys_bot.utils.metrics import metrics
+
+
+ATTACHMENT_CACHE_DIR: Path = Path(os.getenv("ATTACHMENT_CACHE_DIR", "attachment_cache"))
+ATTACHMENT_CACHE_MAX_BYTES: int = int(os.getenv("ATTACHMENT_CACHE_MAX_BYTES", str(512 * 1024 * 1024)))
+MAX_ATTACHMENT_SIZE: int = 20971520
+MAX_INDEXED_ATTACHMENTS: int = 10000
+
+
+class AttachmentRef(NamedTuple):
+    sha256: str
+    url: str
+    content_type: str
+    size: int
+
+
+class AttachmentStore:
+    def __init__(self, directory: Path, max_bytes: int) -> None:
+        # Attachments are keyed by their content hash.
+        self.cache = DiskCache(directory, max_bytes)
+        # Discord attachment ID -> reference, so quoted or re-read attachments are not downloaded again.
+        self.index: OrderedDict[int, AttachmentRef] = OrderedDict()
+        # Other kinds of reference -> how to load them, for content kept outside this store.
+        self.loaders: dict[type, Callable[[Any], Awaitable[types.Part | None]]] = {}
+
+    async def store(self, attachment: discord.Attachment) -> AttachmentRef | None:
+        if attachment.id in self.index:
+            self.index.move_to_end(attachment.id)
+            return self.index[attachment.id]
+        if attachment.size >= MAX_ATTACHMENT_SIZE:
+            return None
+        data = await attachment.read()
+        metrics.increment("downloaded_bytes", len(data), source="discord")
+        ref = AttachmentRef(hashlib.sha256(data).hexdigest(), attachment.url, attachment.content_type or "application/octet-stream", len(data))
+        await asyncio.to_thread(self.cache.put_bytes, ref.sha256, data)
+        self.index[attachment.id] = ref
+        if len(self.index) > MAX_INDEXED_ATTACHMENTS:
+            self.index.popitem(last=False)
+        return ref
+
+    async def load(self, ref: AttachmentRef) -> types.Part | None:
+        data = await asyncio.to_thread(self.cache.get_bytes, ref.sha256)
+        if data is None:
+            # Evicted from disk, so we go back to Discord for it while the URL is still valid.
+            try:
+                async with aiohttp.ClientSession() as session:
+                    async with session.get(ref.url) as response:
+                        response.raise_for_status()
+                        data = await response.read()
+                metrics.increment("downloaded_bytes", len(data), source="discord")
+            except aiohttp.ClientError:
+                return None
+            if hashlib.sha256(data).hexdigest() != ref.sha256:
+                return None
+            await asyncio.to_thread(self.cache.put_bytes, ref.sha256, data)
+        return types.Part.from_bytes(data, ref.content_type)
+
+    async def load_contents(self, contents: list[dict[str, Any]]) -> list[dict[str, Any]]:
+        loaded_contents = []
+        for turn in contents:
+            parts = []
+            for part in turn["parts"]:
+                if isinstance(part, AttachmentRef):
+                    part = await self.load(part)
+                elif type(part) in self.loaders:
+                    part = await self.loaders[type(part)](part)
+                if part is None:
+                    continue
+                parts.append(part)
+            loaded_contents.append({**turn, "parts": parts})
+        return loaded_contents
+
+
+attachment_store = AttachmentStore(ATTACHMENT_CACHE_DIR, ATTACHMENT_CACHE_MAX_BYTES)
@@ -0,0 +1,72 @@
+import asyncio
+import datetime
+import os
+import time
+from typing import Awaitable, Callable
+
+import discord
+
+from the_math_guys_bot.utils.activity_index import activity_index
+from the_math_guys_bot.utils.rate_limit import RequestBudget
+
+
+BACKFILL_CONCURRENCY: int = int(os.getenv("BACKFILL_CONCURRENCY", "4"))
+# Budget for history requests across all channels, below Discord's global limit of 50 per second.
+BACKFILL_REQUESTS_PER_SECOND: float = float(os.getenv("BACKFILL_REQUESTS_PER_SECOND", "10"))
+HISTORY_PAGE_SIZE: int = 100
+PROGRESS_INTERVAL: float = 5
+
+
+class Backfill:
+    # Reads the history of every text channel of a guild between since and before, newest first,
+    # into the activity index. Each channel's progress is checkpointed after every page, so an
+    # interrupted backfill resumes where it stopped.
+    def __init__(self, guild: discord.Guild, since: float, before: float, progress: Callable[[int, int, int], Awaitable[None]] | None = None) -> None:
+        self.guild = guild
+        self.since = since
+        self.before = before
+        self.progress = progress
+        self.budget = RequestBudget(BACKFILL_REQUESTS_PER_SECOND)
+        self.semaphore = asyncio.Semaphore(BACKFILL_CONCURRENCY)
+        self.channels_done = 0
+        self.messages = 0
+        self.last_report = 0.0
+
+    async def run(self) -> None:
+        checkpoints = activity_index.get_checkpoints(self.guild.id)
+        channels = self.guild.text_channels
+        await asyncio.gather(*(self.scan(channel, checkpoints.get(channel.id, self.before)) for channel in channels))
+        await self.report(force=True)
+
+    async def scan(self, channel: discord.TextChannel, cursor: float) -> None:
+        async with self.semaphore:
+            while cursor > self.since:
+                await self.budget.wait()
+                try:
+                    page = await channel.history(
+                        limit=HISTORY_PAGE_SIZE,
+                        before=datetime.datetime.fromtimestamp(cursor, datetime.timezone.utc),
+                        after=datetime.datetime.fromtimestamp(self.since, datetime.timezone.utc),
+                        oldest_first=False,
+                    ).flatten()
+                except discord.Forbidden:
+                    page = []
+                for message in page:
+                    activity_index.record(self.guild.id, message.author.id, message.created_at.timestamp())
+                self.messages += len(page)
+                # A short page means there is nothing older left in the window.
+                cursor = min(message.created_at.timestamp() for message in page) if len(page) == HISTORY_PAGE_SIZE else self.since
+                activity_index.set_checkpoint(self.guild.id, channel.id, cursor)
+                await self.report()
+        self.channels_done += 1
+        await self.report()
+
+    async def report(self, force: bool = False) -> None:
+        if self.progress is None or (not force and time.monotonic() - self.last_report < PROGRESS_INTERVAL):
+            return
+        self.last_report = time.monotonic()
+        # Reporting is best effort and must never stop the scan.
+        try:
+            await self.progress(self.channels_done, len(self.guild.text_channels), self.messages)
+        except discord.HTTPException as e:
+            print(f"Could not report backfill progress: {e!r}")
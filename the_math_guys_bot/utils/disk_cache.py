@@ -0,0 +1,115 @@
+import os
+import shutil
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+
+from the_math_guys_bot.utils.metrics import metrics
+
+
+class DiskCache:
+    def __init__(self, directory: Path, max_bytes: int, max_age: float | None = None) -> None:
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.hits = 0
+        self.misses = 0
+        self.directory.mkdir(parents=True, exist_ok=True)
+        # Key -> size on disk, ordered from least to most recently used. The file's mtime is
+        # its creation time, which is what max_age is measured against.
+        self.entries: OrderedDict[str, int] = OrderedDict()
+        self.total_bytes = 0
+        self.last_sweep = 0.0
+        self.lock = threading.Lock()
+        # Worker processes share the directory, so files can be renamed or removed while it is
+        # listed, and a recent temporary file may still be being written.
+        files = []
+        for path in self.directory.glob("*/*"):
+            try:
+                files.append((path.stat(), path))
+            except FileNotFoundError:
+                continue
+        for stat, path in sorted(files, key=lambda file: file[0].st_mtime):
+            if path.suffix == ".tmp":
+                if time.time() - stat.st_mtime > 3600:
+                    path.unlink(missing_ok=True)
+                continue
+            self.entries[path.name] = stat.st_size
+            self.total_bytes += stat.st_size
+
+    def path(self, key: str) -> Path:
+        return self.directory / key[:2] / key
+
+    def get(self, key: str) -> Path | None:
+        path = self.path(key)
+        with self.lock:
+            # With worker processes, other processes add entries this one never saw.
+            if key not in self.entries and path.exists():
+                self.entries[key] = path.stat().st_size
+                self.total_bytes += self.entries[key]
+            if key not in self.entries or not path.exists():
+                self.misses += 1
+                metrics.increment("cache_misses", cache=self.directory.name)
+                return None
+            if self.max_age is not None and time.time() - path.stat().st_mtime > self.max_age:
+                self.remove(key)
+                self.misses += 1
+                metrics.increment("cache_misses", cache=self.directory.name)
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            metrics.increment("cache_hits", cache=self.directory.name)
+            return path
+
+    def get_bytes(self, key: str) -> bytes | None:
+        path = self.get(key)
+        if path is None:
+            return None
+        try:
+            return path.read_bytes()
+        except FileNotFoundError:
+            return None
+
+    def put_bytes(self, key: str, data: bytes) -> Path:
+        path = self.path(key)
+        path.parent.mkdir(exist_ok=True)
+        temp_path = path.with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
+        temp_path.write_bytes(data)
+        return self.commit(key, temp_path)
+
+    def put_file(self, key: str, source: Path) -> Path:
+        path = self.path(key)
+        path.parent.mkdir(exist_ok=True)
+        temp_path = path.with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
+        shutil.copyfile(source, temp_path)
+        return self.commit(key, temp_path)
+
+    def commit(self, key: str, temp_path: Path) -> Path:
+        path = self.path(key)
+        with self.lock:
+            os.replace(temp_path, path)
+            self.total_bytes += path.stat().st_size - self.entries.pop(key, 0)
+            self.entries[key] = path.stat().st_size
+            self.evict()
+        return path
+
+    def remove(self, key: str) -> None:
+        self.total_bytes -= self.entries.pop(key, 0)
+        self.path(key).unlink(missing_ok=True)
+
+    def evict(self) -> None:
+        while self.total_bytes > self.max_bytes and len(self.entries) > 1:
+            self.remove(next(iter(self.entries)))
+        # Expired entries are also dropped on lookup, so the full sweep only runs now and then.
+        now = time.time()
+        if self.max_age is None or now - self.last_sweep < 3600:
+            return
+        self.last_sweep = now
+        for key in list(self.entries)[:-1]:
+            try:
+                expired = now - self.path(key).stat().st_mtime > self.max_age
+            except FileNotFoundError:
+                expired = True
+            if expired:
+                self.remove(key)
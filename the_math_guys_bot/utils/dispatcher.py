@@ -0,0 +1,122 @@
+import asyncio
+import os
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Hashable
+
+from the_math_guys_bot.utils.metrics import metrics
+
+
+EDIT_DEBOUNCE: float = float(os.getenv("EDIT_DEBOUNCE_SECONDS", "2"))
+# How many channels may be answered at the same time.
+DISPATCH_CONCURRENCY: int = int(os.getenv("DISPATCH_CONCURRENCY", "8"))
+
+
+class Job:
+    def __init__(self, key: Hashable, factory: Callable[[], Awaitable[Any]], ready_at: float, enqueued_at: float) -> None:
+        self.key = key
+        self.factory = factory
+        self.ready_at = ready_at
+        self.enqueued_at = enqueued_at
+        self.future: asyncio.Future = asyncio.get_running_loop().create_future()
+        self.task: asyncio.Task | None = None
+
+    def supersede(self) -> None:
+        # The caller gets None instead of a result.
+        if self.task is not None:
+            self.task.cancel()
+        elif not self.future.done():
+            self.future.set_result(None)
+        metrics.increment("superseded_requests")
+
+
+class ChannelDispatcher:
+    # Work for a channel runs one job at a time, in order among the jobs that are ready, while
+    # different channels run in parallel. Jobs are keyed by the message they answer: a new job
+    # for the same message replaces the one still queued and cancels the one already running.
+    def __init__(self, concurrency: int) -> None:
+        self.queues: dict[int, OrderedDict[Hashable, Job]] = {}
+        # Set when a job is queued, so a worker waiting out a debounce looks at it right away.
+        self.wakeups: dict[int, asyncio.Event] = {}
+        self.running: dict[int, Job] = {}
+        self.workers: dict[int, asyncio.Task] = {}
+        self.semaphore = asyncio.Semaphore(concurrency)
+
+    async def submit(self, channel_id: int, key: Hashable, factory: Callable[[], Awaitable[Any]], debounce: float = 0.0) -> Any:
+        # Returns the job's result, or None when a newer job for the same key superseded it.
+        loop = asyncio.get_running_loop()
+        queue = self.queues.setdefault(channel_id, OrderedDict())
+        if key in queue:
+            queue.pop(key).supersede()
+        running = self.running.get(channel_id)
+        if running is not None and running.key == key:
+            running.supersede()
+        job = Job(key, factory, loop.time() + debounce, loop.time())
+        queue[key] = job
+        self.wakeups.setdefault(channel_id, asyncio.Event()).set()
+        metrics.set_gauge("dispatch_queue_depth", len(queue), channel=str(channel_id))
+        if channel_id not in self.workers:
+            self.workers[channel_id] = asyncio.create_task(self.work(channel_id))
+        try:
+            return await job.future
+        except asyncio.CancelledError:
+            # Nobody is left to use the answer.
+            if job.task is not None:
+                job.task.cancel()
+            raise
+
+    async def work(self, channel_id: int) -> None:
+        loop = asyncio.get_running_loop()
+        queue = self.queues[channel_id]
+        wakeup = self.wakeups[channel_id]
+        try:
+            while queue:
+                # A debounced job waits out its delay without holding up the jobs queued after
+                # it, and is skipped until then unless a newer one replaces it.
+                job = next((job for job in queue.values() if job.ready_at <= loop.time()), None)
+                if job is None:
+                    wakeup.clear()
+                    try:
+                        await asyncio.wait_for(wakeup.wait(), min(job.ready_at for job in queue.values()) - loop.time())
+                    except asyncio.TimeoutError:
+                        pass
+                    continue
+                del queue[job.key]
+                metrics.set_gauge("dispatch_queue_depth", len(queue), channel=str(channel_id))
+                if job.future.done():
+                    continue
+                async with self.semaphore:
+                    metrics.observe("queue_wait", loop.time() - job.enqueued_at)
+                    await self.run(channel_id, job)
+        finally:
+            del self.workers[channel_id]
+            if not queue:
+                del self.queues[channel_id]
+                del self.wakeups[channel_id]
+
+    async def run(self, channel_id: int, job: Job) -> None:
+        self.running[channel_id] = job
+        job.task = asyncio.create_task(job.factory())
+        try:
+            # wait() rather than awaiting the task, so its cancellation stays out of the worker.
+            await asyncio.wait({job.task})
+        except asyncio.CancelledError:
+            job.task.cancel()
+            job.future.cancel()
+            raise
+        finally:
+            del self.running[channel_id]
+        if job.future.done():
+            return
+        if job.task.cancelled():
+            job.future.set_result(None)
+        elif job.task.exception() is not None:
+            job.future.set_exception(job.task.exception())
+        else:
+            job.future.set_result(job.task.result())
+
+    def stop(self) -> None:
+        for worker in self.workers.values():
+            worker.cancel()
+        for queue in self.queues.values():
+            for job in queue.values():
+                job.future.cancel()
@@ -1,22 +1,25 @@
 import discord
 
 from google import genai
-from google.genai import types, errors
+from google.genai import errors
 
+from the_math_guys_bot.utils.attachment_store import AttachmentRef, attachment_store
+from the_math_guys_bot.utils.message_cache import MAX_REFERENCE_DEPTH, message_cache
 
-async def get_files_from_message(client: genai.Client, message: discord.Message) -> list[types.Part]:
+
+async def get_files_from_message(client: genai.Client, message: discord.Message, depth: int = 0) -> list[AttachmentRef]:
     result = []
     for attachment in message.attachments:
         try:
-            if attachment.size >= 20971520:
-                continue
-            part = types.Part.from_bytes(await attachment.read(), attachment.content_type)
-            result.append(part)
+            ref = await attachment_store.store(attachment)
+            if ref is not None:
+                result.append(ref)
         except discord.HTTPException:
             pass
         except errors.ClientError:
             pass
-    if message.reference:
-        ref_message = await message.channel.fetch_message(message.reference.message_id)
-        result.extend(await get_files_from_message(client, ref_message))
-    return result
\ No newline at end of file
+    if message.reference and depth < MAX_REFERENCE_DEPTH:
+        ref_message = await message_cache.fetch_reference(message)
+        if ref_message is not None:
+            result.extend(await get_files_from_message(client, ref_message, depth + 1))
+    return result
@@ -0,0 +1,68 @@
+import json
+from typing import Any
+
+
+class JsonStreamParser:
+    # Incremental parser for a streamed JSON object. feed() returns the members of the root
+    # object and the items of its arrays as soon as they are complete, as (path, value) pairs,
+    # e.g. (("introduction",), "...") or (("steps", 0), {...}).
+    def __init__(self) -> None:
+        self.buffer = ""
+        self.position = 0
+        # One frame per open container: its kind, current key, whether a key is expected next,
+        # index of the current item, and the offset where the container started.
+        self.stack: list[dict[str, Any]] = []
+        self.in_string = False
+        self.escape = False
+        self.string_start = 0
+        self.scalar_start: int | None = None
+
+    def feed(self, chunk: str) -> list[tuple[tuple[str | int, ...], Any]]:
+        self.buffer += chunk
+        events = []
+        while self.position < len(self.buffer):
+            char = self.buffer[self.position]
+            if self.in_string:
+                if self.escape:
+                    self.escape = False
+                elif char == "\\":
+                    self.escape = True
+                elif char == '"':
+                    self.in_string = False
+                    self.end_value(self.string_start, self.position + 1, events, is_string=True)
+                self.position += 1
+                continue
+            if self.scalar_start is not None and (char in ",}]" or char.isspace()):
+                self.end_value(self.scalar_start, self.position, events)
+                self.scalar_start = None
+            if char == '"':
+                self.in_string = True
+                self.string_start = self.position
+            elif char in "{[":
+                self.stack.append({"kind": "object" if char == "{" else "array", "key": None, "expecting_key": char == "{", "index": 0, "start": self.position})
+            elif char in "}]":
+                frame = self.stack.pop()
+                self.end_value(frame["start"], self.position + 1, events)
+            elif char == ":":
+                self.stack[-1]["expecting_key"] = False
+            elif char == ",":
+                if self.stack[-1]["kind"] == "object":
+                    self.stack[-1]["expecting_key"] = True
+                else:
+                    self.stack[-1]["index"] += 1
+            elif not char.isspace() and self.scalar_start is None:
+                self.scalar_start = self.position
+            self.position += 1
+        return events
+
+    def end_value(self, start: int, end: int, events: list[tuple[tuple[str | int, ...], Any]], is_string: bool = False) -> None:
+        if not self.stack:
+            return
+        frame = self.stack[-1]
+        if is_string and frame["kind"] == "object" and frame["expecting_key"]:
+            frame["key"] = json.loads(self.buffer[start:end])
+            return
+        if len(self.stack) == 1 and frame["kind"] == "object":
+            events.append(((frame["key"],), json.loads(self.buffer[start:end])))
+        elif len(self.stack) == 2 and frame["kind"] == "array" and self.stack[0]["kind"] == "object":
+            events.append(((self.stack[0]["key"], frame["index"]), json.loads(self.buffer[start:end])))
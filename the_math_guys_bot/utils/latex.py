@@ -0,0 +1,141 @@
+import asyncio
+import hashlib
+import os
+import tempfile
+from pathlib import Path
+from time import perf_counter
+
+from the_math_guys_bot.utils.disk_cache import DiskCache
+from the_math_guys_bot.utils.metrics import metrics
+
+
+# Each formula is its own page, so a whole answer is compiled by a single latex run.
+LATEX_TEMPLATE: str = """\\documentclass[multi=true]{{standalone}}
+\\usepackage[spanish]{{babel}}
+\\usepackage{{amsmath}}
+\\usepackage{{amssymb}}
+\\usepackage{{xcolor}}
+
+\\definecolor{{bg}}{{HTML}}{{282B30}}
+\\definecolor{{fg}}{{HTML}}{{EBEBEB}}
+
+\\begin{{document}}
+\\pagecolor{{bg}}
+\\color{{fg}}
+{formulas}
+\\end{{document}}"""
+
+
+LATEX_FORMULA_TEMPLATE: str = """\\begin{{standalone}}
+$\\displaystyle {expression}$
+\\end{{standalone}}"""
+
+
+LATEX_EXPORT_HEIGHT: int = 300
+# Changing the template or the export options invalidates every cached render.
+LATEX_TEMPLATE_VERSION: str = hashlib.sha256(f"{LATEX_TEMPLATE}\0{LATEX_FORMULA_TEMPLATE}\0{LATEX_EXPORT_HEIGHT}".encode()).hexdigest()[:16]
+LATEX_CACHE_DIR: Path = Path(os.getenv("LATEX_CACHE_DIR", "latex_cache"))
+LATEX_CACHE_MAX_BYTES: int = int(os.getenv("LATEX_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
+LATEX_CACHE_MAX_AGE: float = float(os.getenv("LATEX_CACHE_MAX_AGE_DAYS", "30")) * 86400
+LATEX_RENDER_WORKERS: int = int(os.getenv("LATEX_RENDER_WORKERS", str(os.cpu_count() or 1)))
+LATEX_RENDER_TIMEOUT: float = float(os.getenv("LATEX_RENDER_TIMEOUT", "30"))
+
+latex_cache = DiskCache(LATEX_CACHE_DIR, LATEX_CACHE_MAX_BYTES, LATEX_CACHE_MAX_AGE)
+render_semaphore = asyncio.Semaphore(LATEX_RENDER_WORKERS)
+# Cache key -> pending image, so a formula that is already being rendered is not rendered again.
+renders: dict[str, asyncio.Future] = {}
+batches: set[asyncio.Task] = set()
+
+
+def get_cache_key(latex_expression: str) -> str:
+    return hashlib.sha256(f"{LATEX_TEMPLATE_VERSION}\0{latex_expression}".encode()).hexdigest()
+
+
+async def run_process(*args: str, cwd: str) -> int:
+    start = perf_counter()
+    process = await asyncio.create_subprocess_exec(*args, cwd=cwd, stdout=asyncio.subprocess.DEVNULL, stderr=asyncio.subprocess.DEVNULL)
+    try:
+        return await process.wait()
+    finally:
+        # Timeouts and cancellations land here, and the tool must not outlive its job.
+        if process.returncode is None:
+            process.kill()
+            await process.wait()
+        metrics.increment("subprocess_seconds", perf_counter() - start, program=args[0])
+
+
+async def render_in_directory(latex_expressions: list[str], keys: list[str], directory: str) -> list[Path | None]:
+    formulas = "\n".join(LATEX_FORMULA_TEMPLATE.format(expression=expression) for expression in latex_expressions)
+    Path(directory, "formulas.tex").write_text(LATEX_TEMPLATE.format(formulas=formulas), encoding="utf-8")
+    return_code = await run_process("latex", "-interaction=nonstopmode", "-no-shell-escape", "formulas.tex", cwd=directory)
+    # With several formulas, an error in one of them can shift or break the other pages.
+    if return_code != 0 and len(latex_expressions) > 1:
+        return [None] * len(latex_expressions)
+    await run_process("dvisvgm", "formulas.dvi", "--page=1-", "-n", "-b", "min", "-c", "1,1", "-o", "formula-%p.svg", cwd=directory)
+    svg_paths = sorted(Path(directory).glob("formula-*.svg"), key=lambda path: int(path.stem.rsplit("-", 1)[1]))
+    if len(svg_paths) != len(latex_expressions):
+        return [None] * len(latex_expressions)
+    await run_process("inkscape", "--export-type=png", f"--export-height={LATEX_EXPORT_HEIGHT}", *(path.name for path in svg_paths), cwd=directory)
+    images = []
+    for key, svg_path in zip(keys, svg_paths):
+        image_path = svg_path.with_suffix(".png")
+        images.append(await asyncio.to_thread(latex_cache.put_file, key, image_path) if image_path.exists() else None)
+    return images
+
+
+async def render(latex_expressions: list[str], keys: list[str]) -> list[Path | None]:
+    # Every job gets its own directory, so concurrent renders never share their files.
+    async with render_semaphore:
+        with tempfile.TemporaryDirectory(prefix="latex-") as directory:
+            try:
+                return await asyncio.wait_for(render_in_directory(latex_expressions, keys, directory), LATEX_RENDER_TIMEOUT)
+            except (asyncio.TimeoutError, OSError):
+                return [None] * len(latex_expressions)
+
+
+async def render_batch(latex_expressions: list[str], keys: list[str]) -> None:
+    images: list[Path | None] = [None] * len(latex_expressions)
+    try:
+        images = await render(latex_expressions, keys)
+        failed = [i for i, image in enumerate(images) if image is None]
+        if len(latex_expressions) > 1 and failed:
+            # One broken formula takes the whole batch down, so the failures are retried one by one.
+            retried = await asyncio.gather(*(render([latex_expressions[i]], [keys[i]]) for i in failed))
+            for i, retried_images in zip(failed, retried):
+                images[i] = retried_images[0]
+    finally:
+        for key, image in zip(keys, images):
+            future = renders.pop(key)
+            if not future.done():
+                future.set_result(image)
+
+
+async def latex2images(latex_expressions: list[str]) -> list[Path | None]:
+    keys = [get_cache_key(latex_expression) for latex_expression in latex_expressions]
+    images: dict[str, Path | None] = {}
+    pending: dict[str, asyncio.Future] = {}
+    missing: dict[str, str] = {}
+    for key, latex_expression in zip(keys, latex_expressions):
+        if key in images or key in pending or key in missing:
+            continue
+        if key in renders:
+            pending[key] = renders[key]
+            continue
+        image = latex_cache.get(key)
+        if image is None:
+            missing[key] = latex_expression
+        else:
+            images[key] = image
+    if missing:
+        for key in missing:
+            renders[key] = pending[key] = asyncio.get_running_loop().create_future()
+        batch = asyncio.create_task(render_batch(list(missing.values()), list(missing)))
+        batches.add(batch)
+        batch.add_done_callback(batches.discard)
+    for key, future in pending.items():
+        images[key] = await asyncio.shield(future)
+    return [images[key] for key in keys]
+
+
+async def latex2image(latex_expression: str) -> Path | None:
+    return (await latex2images([latex_expression]))[0]
@@ -0,0 +1,63 @@
+import asyncio
+import os
+from collections import OrderedDict
+
+import discord
+
+
+MESSAGE_CACHE_SIZE: int = int(os.getenv("MESSAGE_CACHE_SIZE", "5000"))
+MAX_REFERENCE_DEPTH: int = int(os.getenv("MAX_REFERENCE_DEPTH", "3"))
+
+
+class MessageCache:
+    def __init__(self, max_size: int) -> None:
+        self.max_size = max_size
+        self.messages: OrderedDict[int, discord.Message] = OrderedDict()
+        self.pending: dict[int, asyncio.Future] = {}
+
+    def add(self, message: discord.Message) -> None:
+        self.messages[message.id] = message
+        self.messages.move_to_end(message.id)
+        if len(self.messages) > self.max_size:
+            self.messages.popitem(last=False)
+
+    def invalidate(self, message_id: int) -> None:
+        self.messages.pop(message_id, None)
+
+    async def fetch(self, channel: discord.abc.Messageable, message_id: int) -> discord.Message | None:
+        if message_id in self.messages:
+            self.messages.move_to_end(message_id)
+            return self.messages[message_id]
+        # Concurrent lookups of the same message share a single request.
+        if message_id in self.pending:
+            return await asyncio.shield(self.pending[message_id])
+        future = asyncio.get_running_loop().create_future()
+        self.pending[message_id] = future
+        try:
+            message = await channel.fetch_message(message_id)
+        except discord.NotFound:
+            message = None
+        except BaseException as e:
+            self.pending.pop(message_id, None)
+            if isinstance(e, Exception):
+                future.set_exception(e)
+                future.exception()
+            else:
+                future.cancel()
+            raise
+        self.pending.pop(message_id, None)
+        if message is not None:
+            self.add(message)
+        future.set_result(message)
+        return message
+
+    async def fetch_reference(self, message: discord.Message) -> discord.Message | None:
+        if message.reference is None or message.reference.message_id is None:
+            return None
+        # The gateway usually sends the replied message along, which saves the request entirely.
+        if isinstance(message.reference.resolved, discord.Message) and message.reference.message_id not in self.messages:
+            self.add(message.reference.resolved)
+        return await self.fetch(message.channel, message.reference.message_id)
+
+
+message_cache = MessageCache(MESSAGE_CACHE_SIZE)
@@ -0,0 +1,91 @@
+import os
+import time
+from collections import defaultdict, deque
+from contextlib import contextmanager
+from typing import Any, Iterator
+
+
+METRICS_WINDOW: int = int(os.getenv("METRICS_WINDOW", "1000"))
+METRICS_PREFIX: str = "themathguysbot"
+
+
+def percentile(values: list[float], p: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(int(p / 100 * len(values)), len(values) - 1)]
+
+
+def escape_label(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def format_labels(labels: tuple[tuple[str, str], ...]) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{escape_label(value)}"' for name, value in labels) + "}"
+
+
+class Metrics:
+    # Stage timings keep their last METRICS_WINDOW samples for percentiles, plus a running count
+    # and sum since startup. Counters and gauges are keyed by name and labels.
+    def __init__(self, window: int) -> None:
+        self.window = window
+        self.durations: defaultdict[str, deque[float]] = defaultdict(lambda: deque(maxlen=self.window))
+        self.duration_counts: defaultdict[str, int] = defaultdict(int)
+        self.duration_sums: defaultdict[str, float] = defaultdict(float)
+        self.counters: defaultdict[tuple[str, tuple[tuple[str, str], ...]], float] = defaultdict(float)
+        self.gauges: dict[tuple[str, tuple[tuple[str, str], ...]], float] = {}
+        # Worker processes set this to a list, and send what it collects to the bot's process
+        # as (method, arguments, labels).
+        self.forwarded: list[tuple[str, tuple[Any, ...], dict[str, str]]] | None = None
+
+    def observe(self, stage: str, seconds: float) -> None:
+        if self.forwarded is not None:
+            self.forwarded.append(("observe", (stage, seconds), {}))
+        self.durations[stage].append(seconds)
+        self.duration_counts[stage] += 1
+        self.duration_sums[stage] += seconds
+
+    @contextmanager
+    def span(self, stage: str) -> Iterator[None]:
+        # Also usable around awaits, in which case it measures the stage's wall time.
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - start)
+
+    def increment(self, name: str, value: float = 1, **labels: str) -> None:
+        if self.forwarded is not None:
+            self.forwarded.append(("increment", (name, value), labels))
+        self.counters[name, tuple(sorted(labels.items()))] += value
+
+    def set_gauge(self, name: str, value: float, **labels: str) -> None:
+        if self.forwarded is not None:
+            self.forwarded.append(("set_gauge", (name, value), labels))
+        self.gauges[name, tuple(sorted(labels.items()))] = value
+
+    def get_summary(self, stage: str) -> tuple[int, float, float]:
+        # Samples in the window, and their p50 and p95 in seconds.
+        values = list(self.durations[stage])
+        return len(values), percentile(values, 50), percentile(values, 95)
+
+    def render_prometheus(self) -> str:
+        lines = [f"# TYPE {METRICS_PREFIX}_stage_seconds summary"]
+        for stage in sorted(self.durations):
+            values = list(self.durations[stage])
+            for quantile in (0.5, 0.95, 0.99):
+                lines.append(f"{METRICS_PREFIX}_stage_seconds{format_labels((('stage', stage), ('quantile', str(quantile))))} {percentile(values, quantile * 100)}")
+            lines.append(f"{METRICS_PREFIX}_stage_seconds_count{format_labels((('stage', stage),))} {self.duration_counts[stage]}")
+            lines.append(f"{METRICS_PREFIX}_stage_seconds_sum{format_labels((('stage', stage),))} {self.duration_sums[stage]}")
+        for name in sorted({name for name, _ in self.counters}):
+            lines.append(f"# TYPE {METRICS_PREFIX}_{name}_total counter")
+            lines.extend(f"{METRICS_PREFIX}_{name}_total{format_labels(labels)} {value}" for (counter, labels), value in sorted(self.counters.items()) if counter == name)
+        for name in sorted({name for name, _ in self.gauges}):
+            lines.append(f"# TYPE {METRICS_PREFIX}_{name} gauge")
+            lines.extend(f"{METRICS_PREFIX}_{name}{format_labels(labels)} {value}" for (gauge, labels), value in sorted(self.gauges.items()) if gauge == name)
+        return "\n".join(lines) + "\n"
+
+
+metrics = Metrics(METRICS_WINDOW)
@@ -0,0 +1,89 @@
+import json
+import os
+import sqlite3
+import threading
+from pathlib import Path
+
+
+POINTS_DB_PATH: Path = Path(os.getenv("POINTS_DB_PATH", "thankfulness_points.db"))
+LEGACY_POINTS_FILE: Path = Path("thankfulness_points.json")
+
+
+class PointsStore:
+    # Thankfulness points in SQLite (WAL). Every change is its own small transaction, and the
+    # index on points lets leaderboard pages seek to where the previous page ended.
+    def __init__(self, path: Path) -> None:
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.lock = threading.Lock()
+        with self.lock, self.connection:
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            self.connection.execute("PRAGMA synchronous=NORMAL")
+            self.connection.execute("CREATE TABLE IF NOT EXISTS points (member_id INTEGER PRIMARY KEY, points INTEGER NOT NULL)")
+            self.connection.execute("CREATE INDEX IF NOT EXISTS points_by_rank ON points (points DESC, member_id)")
+        if self.count() == 0 and LEGACY_POINTS_FILE.exists():
+            self.migrate(LEGACY_POINTS_FILE)
+
+    def migrate(self, points_file: Path) -> None:
+        with open(points_file, "r") as f:
+            legacy_points = json.load(f)
+        with self.lock, self.connection:
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO points (member_id, points) VALUES (?, ?)",
+                ((int(member_id), points) for member_id, points in legacy_points.items()),
+            )
+
+    def add(self, member_id: int, delta: int) -> int:
+        # Points never go below zero.
+        with self.lock, self.connection:
+            self.connection.execute(
+                "INSERT INTO points (member_id, points) VALUES (?, max(?, 0)) ON CONFLICT (member_id) DO UPDATE SET points = max(points + ?, 0)",
+                (member_id, delta, delta),
+            )
+            return self.connection.execute("SELECT points FROM points WHERE member_id = ?", (member_id,)).fetchone()[0]
+
+    def get(self, member_id: int) -> int | None:
+        with self.lock:
+            row = self.connection.execute("SELECT points FROM points WHERE member_id = ?", (member_id,)).fetchone()
+        return row[0] if row is not None else None
+
+    def rank(self, member_id: int) -> int | None:
+        # Helpers with the same points share their rank. SQLite keeps no counts in the index,
+        # so this walks the index over every helper ahead: O(rank), not O(log n).
+        points = self.get(member_id)
+        if points is None:
+            return None
+        with self.lock:
+            return self.connection.execute("SELECT count(*) FROM points WHERE points > ?", (points,)).fetchone()[0] + 1
+
+    def remove(self, member_id: int) -> None:
+        with self.lock, self.connection:
+            self.connection.execute("DELETE FROM points WHERE member_id = ?", (member_id,))
+
+    def count(self) -> int:
+        with self.lock:
+            return self.connection.execute("SELECT count(*) FROM points").fetchone()[0]
+
+    def page(self, after: tuple[int, int] | None, limit: int) -> list[tuple[int, int]]:
+        # after is the (member_id, points) row that ended the previous page. SQLite only seeks
+        # on the first column of a row value, so the rest of its tie is read on its own.
+        if after is None:
+            with self.lock:
+                return self.connection.execute(
+                    "SELECT member_id, points FROM points ORDER BY points DESC, member_id LIMIT ?",
+                    (limit,),
+                ).fetchall()
+        member_id, points = after
+        with self.lock:
+            rows = self.connection.execute(
+                "SELECT member_id, points FROM points WHERE points = ? AND member_id > ? ORDER BY member_id LIMIT ?",
+                (points, member_id, limit),
+            ).fetchall()
+            if len(rows) < limit:
+                rows += self.connection.execute(
+                    "SELECT member_id, points FROM points WHERE points < ? ORDER BY points DESC, member_id LIMIT ?",
+                    (points, limit - len(rows)),
+                ).fetchall()
+        return rows
+
+
+points_store = PointsStore(POINTS_DB_PATH)
@@ -0,0 +1,17 @@
+import asyncio
+import time
+
+
+class RequestBudget:
+    # Spaces requests evenly, whichever of the concurrent workers makes them.
+    def __init__(self, requests_per_second: float) -> None:
+        self.interval = 1 / requests_per_second
+        self.next_request = 0.0
+        self.lock = asyncio.Lock()
+
+    async def wait(self) -> None:
+        async with self.lock:
+            now = time.monotonic()
+            if self.next_request > now:
+                await asyncio.sleep(self.next_request - now)
+            self.next_request = max(now, self.next_request) + self.interval
@@ -0,0 +1,102 @@
+import asyncio
+import datetime
+import heapq
+import itertools
+import os
+import time
+from typing import Any, Awaitable, Callable
+
+
+# A reminder missed while the bot was down is still sent if it was due at most this long ago.
+CATCH_UP_WINDOW: float = float(os.getenv("TASK_CATCH_UP_WINDOW_HOURS", "6")) * 3600
+# The sleep is cut short now and then, so wall clock changes are noticed.
+MAX_SLEEP: float = 3600
+
+
+def get_next_fire_time(task: dict[str, Any], after: float) -> float:
+    # Tasks fire every day at hour:minute in their own UTC offset, given in whole hours.
+    timezone = datetime.timezone(datetime.timedelta(hours=task["timezone"]))
+    after_time = datetime.datetime.fromtimestamp(after, timezone)
+    fire_time = after_time.replace(hour=task["hour"], minute=task["minute"], second=0, microsecond=0)
+    if fire_time <= after_time:
+        fire_time += datetime.timedelta(days=1)
+    return fire_time.timestamp()
+
+
+class TaskScheduler:
+    # One min-heap of (fire time, generation, task name) for every task, and a single loop that
+    # sleeps until the earliest one is due. Edits and cancellations only bump the task's
+    # generation, and stale heap entries are dropped when they reach the top.
+    def __init__(self, fire: Callable[[str, dict[str, Any], float], Awaitable[None]]) -> None:
+        self.fire = fire
+        self.heap: list[tuple[float, int, str]] = []
+        self.generations: dict[str, int] = {}
+        self.tasks: dict[str, dict[str, Any]] = {}
+        self.counter = itertools.count()
+        self.wakeup = asyncio.Event()
+        self.runner: asyncio.Task | None = None
+        self.firing: set[asyncio.Task] = set()
+
+    def schedule(self, task_name: str, task: dict[str, Any]) -> None:
+        # Adds or replaces a task. Its last fire time decides whether a missed fire is caught up.
+        now = time.time()
+        last_fired = task.get("last_fired")
+        since = now if last_fired is None else max(last_fired, now - CATCH_UP_WINDOW)
+        try:
+            fire_time = get_next_fire_time(task, since)
+        except (ValueError, OverflowError):
+            print(f"Invalid schedule for task {task_name}: {task}")
+            self.cancel(task_name)
+            return
+        self.tasks[task_name] = task
+        self.push(task_name, fire_time)
+
+    def push(self, task_name: str, fire_time: float) -> None:
+        generation = next(self.counter)
+        self.generations[task_name] = generation
+        heapq.heappush(self.heap, (fire_time, generation, task_name))
+        # Stale entries are rebuilt away once they outnumber the live ones.
+        if len(self.heap) > 2 * len(self.generations) + 16:
+            self.heap = [entry for entry in self.heap if self.generations.get(entry[2]) == entry[1]]
+            heapq.heapify(self.heap)
+        self.wakeup.set()
+
+    def cancel(self, task_name: str) -> None:
+        self.generations.pop(task_name, None)
+        self.tasks.pop(task_name, None)
+
+    def start(self) -> None:
+        if self.runner is None or self.runner.done():
+            self.runner = asyncio.create_task(self.run())
+
+    def stop(self) -> None:
+        if self.runner is not None:
+            self.runner.cancel()
+        for firing in self.firing:
+            firing.cancel()
+
+    async def run(self) -> None:
+        while True:
+            self.wakeup.clear()
+            while self.heap and self.generations.get(self.heap[0][2]) != self.heap[0][1]:
+                heapq.heappop(self.heap)
+            delay = min(self.heap[0][0] - time.time(), MAX_SLEEP) if self.heap else MAX_SLEEP
+            if delay > 0:
+                try:
+                    await asyncio.wait_for(self.wakeup.wait(), delay)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            fire_time, _, task_name = heapq.heappop(self.heap)
+            task = self.tasks[task_name]
+            self.push(task_name, get_next_fire_time(task, max(fire_time, time.time())))
+            # Sending runs on its own, so a slow channel does not hold back the other tasks.
+            firing = asyncio.create_task(self.run_task(task_name, task, fire_time))
+            self.firing.add(firing)
+            firing.add_done_callback(self.firing.discard)
+
+    async def run_task(self, task_name: str, task: dict[str, Any], fire_time: float) -> None:
+        try:
+            await self.fire(task_name, task, fire_time)
+        except Exception as e:
+            print(f"Task {task_name} failed: {e!r}")
@@ -0,0 +1,72 @@
+import json
+import os
+import sqlite3
+import threading
+from pathlib import Path
+from typing import Any
+
+
+TASKS_DB_PATH: Path = Path(os.getenv("TASKS_DB_PATH", "tasks.db"))
+LEGACY_TASKS_FILE: Path = Path("tasks.json")
+
+
+def get_definition(task: dict[str, Any] | None) -> dict[str, Any] | None:
+    # What the task is, without the bookkeeping the scheduler adds to it.
+    if task is None:
+        return None
+    return {key: value for key, value in task.items() if key != "last_fired"}
+
+
+class TaskStore:
+    # Reminder tasks in SQLite (WAL), with an in-memory copy so reads never touch the disk.
+    # A batch of additions, edits and removals is a single transaction, and writes that would
+    # not change anything are skipped.
+    def __init__(self, path: Path) -> None:
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.lock = threading.Lock()
+        with self.lock, self.connection:
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            self.connection.execute("PRAGMA synchronous=NORMAL")
+            self.connection.execute("CREATE TABLE IF NOT EXISTS tasks (task_name TEXT PRIMARY KEY, task TEXT NOT NULL)")
+        self.tasks: dict[str, dict[str, Any]] = {
+            task_name: json.loads(task) for task_name, task in self.connection.execute("SELECT task_name, task FROM tasks")
+        }
+        if not self.tasks and LEGACY_TASKS_FILE.exists():
+            self.migrate(LEGACY_TASKS_FILE)
+
+    def migrate(self, tasks_file: Path) -> None:
+        with open(tasks_file, "r", encoding="utf-8") as f:
+            legacy_tasks = json.load(f)
+        self.apply(list(legacy_tasks.values()), [], [])
+
+    def apply(self, tasks_to_add: list[dict[str, Any]], tasks_to_edit: list[dict[str, Any]], tasks_to_remove: list[str]) -> tuple[dict[str, dict[str, Any]], list[str]]:
+        # Returns the tasks that were added or changed, and the names of the ones removed.
+        # Removals are applied last, as a task can be added and removed in the same response.
+        changed = {
+            task["task_name"]: task for task in [*tasks_to_add, *tasks_to_edit]
+            if task["task_name"] not in tasks_to_remove and get_definition(self.tasks.get(task["task_name"])) != get_definition(task)
+        }
+        removed = [task_name for task_name in dict.fromkeys(tasks_to_remove) if task_name in self.tasks]
+        if not changed and not removed:
+            return {}, []
+        with self.lock, self.connection:
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO tasks (task_name, task) VALUES (?, ?)",
+                ((task_name, json.dumps(task, ensure_ascii=False)) for task_name, task in changed.items()),
+            )
+            self.connection.executemany("DELETE FROM tasks WHERE task_name = ?", ((task_name,) for task_name in removed))
+        self.tasks.update(changed)
+        for task_name in removed:
+            self.tasks.pop(task_name)
+        return changed, removed
+
+    def set_last_fired(self, task_name: str, fire_time: float) -> None:
+        task = self.tasks.get(task_name)
+        if task is None:
+            return
+        task["last_fired"] = fire_time
+        with self.lock, self.connection:
+            self.connection.execute("UPDATE tasks SET task = ? WHERE task_name = ?", (json.dumps(task, ensure_ascii=False), task_name))
+
+
+task_store = TaskStore(TASKS_DB_PATH)